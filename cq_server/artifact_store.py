@@ -0,0 +1,116 @@
+'''Module artifact_store: define artifact stores, which persist build results across processes.'''
+
+import os
+import os.path as op
+import tempfile
+from abc import ABC, abstractmethod
+
+
+DEFAULT_STORE_SIZE = 4096 # in MB
+GARBAGE_COLLECTION_RATIO = 0.1 # part of the size limit written between garbage collections
+
+
+def get_file_mode() -> int:
+    '''Return the mode of the files created by the current process, according to its umask.
+    The umask can only be read by changing it, so this is done once on import.'''
+
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+FILE_MODE = get_file_mode()
+
+
+class ArtifactStore(ABC):
+    '''Base class of artifact stores, used to share build results (tesselated models, exported
+    files, thumbnails) between server instances and builds. An artifact is identified by a key,
+    which changes when anything used to build it changes, and by a name.'''
+
+    @abstractmethod
+    def get(self, key: str, name: str) -> bytes:
+        '''Return the content of an artifact, or None if it is not stored.'''
+
+    @abstractmethod
+    def put(self, key: str, name: str, data: bytes) -> None:
+        '''Store the content of an artifact.'''
+
+
+class FileArtifactStore(ArtifactStore):
+    '''Artifact store saving artifacts as files of a local folder, which can be shared by several
+    processes: files are written atomically, and the least recently used files are removed
+    when the folder exceeds its size limit. The folder is scanned on the first write, then each
+    time a tenth of the size limit has been written, so it can temporarily exceed its limit.'''
+
+    def __init__(self, directory: str, max_size: int=DEFAULT_STORE_SIZE):
+        self.directory = op.abspath(directory)
+        self.max_size = max_size * 1024 * 1024
+        self.collection_size = self.max_size * GARBAGE_COLLECTION_RATIO
+        self.written_size = self.collection_size # size written since the last collection
+
+    def get_path(self, key: str, name: str) -> str:
+        '''Return the path of the file of an artifact.'''
+
+        return op.join(self.directory, key[:2], key, name)
+
+    def get(self, key: str, name: str) -> bytes:
+        path = self.get_path(key, name)
+
+        try:
+            with open(path, 'rb') as artifact_file:
+                data = artifact_file.read()
+            os.utime(path) # mark the artifact as recently used
+        except OSError:
+            return None
+
+        return data
+
+    def put(self, key: str, name: str, data: bytes) -> None:
+        path = self.get_path(key, name)
+        os.makedirs(op.dirname(path), exist_ok=True)
+
+        # temporary files start with a dot, so they are ignored by other processes
+        with tempfile.NamedTemporaryFile(dir=op.dirname(path), prefix='.', delete=False) \
+                as tmp_file:
+            tmp_file.write(data)
+
+        os.chmod(tmp_file.name, FILE_MODE) # temporary files are only readable by their owner
+        os.replace(tmp_file.name, path)
+        self.written_size += len(data)
+
+        if self.written_size >= self.collection_size:
+            self.written_size = 0
+            self.collect_garbage()
+
+    def collect_garbage(self) -> None:
+        '''Remove the least recently used artifacts until the store fits in its size limit.'''
+
+        if not self.max_size:
+            return
+
+        artifacts = []
+
+        for folder_path, _folders, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name.startswith('.'):
+                    continue
+
+                path = op.join(folder_path, file_name)
+                try:
+                    stat = os.stat(path)
+                    artifacts.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    pass # removed by another process
+
+        total_size = sum(size for _timestamp, size, _path in artifacts)
+
+        for _timestamp, size, path in sorted(artifacts):
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+                total_size -= size
+                os.rmdir(op.dirname(path))
+            except OSError:
+                pass # the artifact folder is not empty, or was removed by another process
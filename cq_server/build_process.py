@@ -0,0 +1,213 @@
+'''Module build_process: run CadQuery builds in a child process, bounded by resource limits.'''
+
+import sys
+import signal
+import traceback
+import multiprocessing
+from io import BytesIO
+from typing import List, Tuple, Union
+
+
+class BuildLimits:
+    '''Resource limits applied to each build, where 0 means no limit.'''
+
+    def __init__(self, wall_time: float=0, cpu_time: int=0, memory: int=0):
+        self.wall_time = wall_time # in seconds
+        self.cpu_time = cpu_time # in seconds
+        self.memory = memory # address space, in MB
+
+    def is_set(self) -> bool:
+        '''Return True if at least one limit is defined.'''
+
+        return bool(self.wall_time or self.cpu_time or self.memory)
+
+
+class BuildProcessError(Exception):
+    '''Error raised when a build running in a child process failed or exceeded a limit.'''
+
+    def __init__(self, message: str, stacktrace: str=''):
+        self.message = message
+        self.stacktrace = stacktrace
+        super().__init__(self.message)
+
+
+def get_context():
+    '''Return the multiprocessing context used to start build processes. When available,
+    a fork server with CadQuery preloaded makes starting a build process cheap.'''
+
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([ 'cadquery' ])
+    return context
+
+
+def build_objects_in_process(module_path: str, modules_dir: str, limits: BuildLimits,
+        profile: bool=False) -> Tuple[List[tuple], dict]:
+    '''Build a CadQuery script in a child process bounded by the given limits, and return its
+    objects as a list of (object, color, name) tuples, where the object is a shape or an assembly
+    and the color is a rgba tuple, and the profile of the build if profile is True (see
+    ScriptProfiler), or None.'''
+
+    context = get_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_build_worker, daemon=True,
+        args=(sender, module_path, modules_dir, limits, profile))
+
+    process.start()
+    sender.close()
+    response = None
+    is_timed_out = False
+
+    try:
+        if receiver.poll(limits.wall_time or None):
+            response = receiver.recv()
+        else:
+            is_timed_out = True
+    except EOFError:
+        pass # the process died before sending a response
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
+
+    if is_timed_out:
+        raise BuildProcessError(
+            f'The build exceeded its time limit of { limits.wall_time } seconds.')
+
+    if response is None:
+        raise BuildProcessError(get_exit_message(process.exitcode, limits))
+
+    status, value = response
+
+    if status == 'error':
+        raise BuildProcessError(*value)
+
+    objects, build_profile = value
+    return [ (deserialize_object(data), color, name) for data, color, name in objects ], \
+        build_profile
+
+
+def serialize_object(cq_object) -> Union[bytes, dict]:
+    '''Serialize an object passed to show_object, so it can be sent to another process: shapes
+    and workplanes are serialized as BRep, assemblies as a tree of dictionaries keeping
+    the name, color and location of each sub-assembly.'''
+    # pylint: disable=import-outside-toplevel
+
+    from cadquery import Assembly
+    from .module_manager import to_shape
+
+    if not isinstance(cq_object, Assembly):
+        brep = BytesIO()
+        to_shape(cq_object).exportBrep(brep)
+        return brep.getvalue()
+
+    return {
+        'name': cq_object.name,
+        'obj': serialize_object(cq_object.obj) if cq_object.obj is not None else None,
+        'loc': get_location_matrix(cq_object.loc),
+        'color': cq_object.color.toTuple() if cq_object.color else None,
+        'children': [ serialize_object(child) for child in cq_object.children ]
+    }
+
+
+def deserialize_object(data: Union[bytes, dict]):
+    '''Return the shape or the assembly serialized by serialize_object().'''
+    # pylint: disable=import-outside-toplevel
+
+    from cadquery import Assembly, Color, Shape
+
+    if isinstance(data, bytes):
+        return Shape.importBrep(BytesIO(data))
+
+    assembly = Assembly(deserialize_object(data['obj']) if data['obj'] is not None else None,
+        loc=get_location(data['loc']), name=data['name'],
+        color=Color(*data['color']) if data['color'] else None)
+
+    for child in data['children']:
+        assembly.add(deserialize_object(child))
+
+    return assembly
+
+
+def get_location_matrix(location) -> List[float]:
+    '''Return the 3x4 transformation matrix of a CadQuery location, as a flat list.'''
+
+    transformation = location.wrapped.Transformation()
+    return [ transformation.Value(row, column) for row in range(1, 4) for column in range(1, 5) ]
+
+
+def get_location(matrix: List[float]):
+    '''Return the CadQuery location of a transformation matrix given by get_location_matrix().'''
+    # pylint: disable=import-outside-toplevel
+
+    from cadquery import Location
+    from OCP.gp import gp_Trsf
+
+    transformation = gp_Trsf()
+    transformation.SetValues(*matrix)
+    return Location(transformation)
+
+
+def get_exit_message(exit_code: int, limits: BuildLimits) -> str:
+    '''Return a message explaining why a build process ended without response.'''
+
+    if exit_code in [ -getattr(signal, 'SIGXCPU', 0), -getattr(signal, 'SIGKILL', 0) ] \
+            and limits.cpu_time:
+        return f'The build exceeded its CPU time limit of { limits.cpu_time } seconds.'
+
+    if limits.memory:
+        return f'The build process crashed (exit code { exit_code }), ' \
+            + f'it may have exceeded its memory limit of { limits.memory } MB.'
+
+    return f'The build process crashed (exit code { exit_code }).'
+
+
+def set_limits(limits: BuildLimits) -> None:
+    '''Apply the CPU time and memory limits to the current process, on platforms supporting it.'''
+    # pylint: disable=import-outside-toplevel
+
+    try:
+        import resource
+    except ImportError:
+        return
+
+    if limits.cpu_time:
+        # the soft limit sends SIGXCPU, the hard limit SIGKILL one second later
+        resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_time, limits.cpu_time + 1))
+
+    if limits.memory:
+        memory = limits.memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+
+def _build_worker(sender, module_path: str, modules_dir: str, limits: BuildLimits,
+        profile: bool) -> None:
+    '''Build a module and send its serialized objects with the build profile,
+    or the error that occured.'''
+    # pylint: disable=import-outside-toplevel
+
+    from .module_manager import ModuleManager, ModuleManagerError
+
+    set_limits(limits)
+    sys.path.insert(1, modules_dir)
+
+    try:
+        module_manager = ModuleManager(module_path, True, profile=profile)
+        objects = [ (serialize_object(cq_object), color, name)
+            for cq_object, color, name in module_manager.build_objects() ]
+        response = ('ok', (objects, module_manager.build_profile))
+    except (ModuleManagerError, MemoryError) as error:
+        if isinstance(error, MemoryError) or isinstance(error.__cause__, MemoryError):
+            message = f'The build exceeded its memory limit of { limits.memory } MB.'
+        else:
+            message = error.message
+
+        response = ('error', (message, getattr(error, 'stacktrace', traceback.format_exc())))
+    except Exception as error: # pylint: disable=broad-except
+        response = ('error', (str(error), traceback.format_exc()))
+
+    sender.send(response)
+    sender.close()
@@ -2,12 +2,22 @@
 
 from sys import exit as sys_exit
 import argparse
+import os
 import os.path as op
+from typing import Dict, List
 
 from . import __version__ as cqs_version
+from .model_cache import ModelCache, DEFAULT_CACHE_SIZE
+from .build_process import BuildLimits
+from .artifact_store import FileArtifactStore, DEFAULT_STORE_SIZE
+from .tesselation_pool import TesselationPool
+from .formats import EXPORT_FORMATS
 
 
 DEFAULT_PORT = 5000
+DEFAULT_MAX_BUILDS = os.cpu_count() or 1
+BUILD_FORMATS = [ 'html' ] + [ file_format for file_format in EXPORT_FORMATS
+    if file_format != 'js' ] # js files are only built for websites
 
 
 def parse_args(parser: argparse.ArgumentParser) -> argparse.Namespace:
@@ -28,16 +38,31 @@ def parse_args(parser: argparse.ArgumentParser) -> argparse.Namespace:
 cq-server run                    # run cq-server with current folder as target on port 5000
 cq-server run -p 8080 ./examples # run cq-server with "examples" as target on port 8080
 cq-server run ./examples/box.py  # run cq-server with only box.py as target
+cq-server run proj_a proj_b=./b  # serve "proj_a" on /proj_a/ and "b" on /proj_b/
 ''')
 
-    parser_run.add_argument('target', nargs='?', default='.',
-        help='python file or folder containing CadQuery script to load (default: ".")')
+    parser_run.add_argument('target', nargs='*', default=[ '.' ],
+        help='python file or folder containing CadQuery script to load (default: "."), ' \
+            + 'several targets can be given as [PREFIX=]TARGET to serve them under url prefixes')
     parser_run.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
         help=f'server port (default: { DEFAULT_PORT })')
     parser_run.add_argument('-r', '--raise', dest='should_raise', action='store_true',
         help='when an error happen, raise it instead showing its title')
     parser_run.add_argument('-d', '--dead', action='store_true',
         help='disable live reloading')
+    parser_run.add_argument('--cache-size', metavar='MB', type=int, default=DEFAULT_CACHE_SIZE,
+        help='memory budget of the models cache, 0 for unlimited ' \
+            + f'(default: { DEFAULT_CACHE_SIZE })')
+    parser_run.add_argument('--max-rss', metavar='MB', type=int, default=0,
+        help='free cached models when the server process memory exceeds this limit ' \
+            + '(default: 0, no limit)')
+    parser_run.add_argument('--prebuild', metavar='N', type=int, default=0,
+        help='in a folder, build all modules in background with N low-priority worker ' \
+            + 'processes, so they open instantly (default: 0, disabled)')
+    parser_run.add_argument('--max-builds', metavar='N', type=parse_non_negative_int,
+        default=DEFAULT_MAX_BUILDS, help='maximum number of modules built at the same time ' \
+            + 'by client requests, for all targets, 0 for no limit (default: number of cpus)')
+    add_model_options(parser_run)
     add_ui_options(parser_run)
 
     parser_build = subparsers.add_parser('build',
@@ -47,19 +72,34 @@ cq-server run ./examples/box.py  # run cq-server with only box.py as target
 cq-server build examples docs                   # build website of "example" project in "docs"
 cq-server build examples/box.py                 # build web page of box.py in examples/box.html
 cq-server build examples/box.py -f stl          # build stl file in examples/box.stl
+cq-server build examples/box.py -f stl,png      # build stl and png files in examples/
 cq-server build examples/box.png build          # build web page in build/box.html
-cq-server build examples/box.png build/box.step # build step file in build/box.step''')
+cq-server build examples/box.png build/box.step # build step file in build/box.step
+cq-server build examples stl -f stl --watch     # export stl files again on each change''')
     parser_build.add_argument('target', nargs='?', default='.',
         help='python file or folder containing CadQuery script to load (default: ".")')
     parser_build.add_argument('dest', metavar='destination', nargs='?',
         help='output file path (default: "<module_name>.html"), or `-` for stdout.')
     parser_build.add_argument('-f', '--format', metavar='FMT',
-        choices=[ 'html', 'json', 'step', 'xml', 'gltf', 'vtkjs', 'vrml', 'dxf',
-            'svg', 'stl', 'amf', 'tjs', 'vtp', '3mf', 'png', 'pdf' ],
-        help='output format: html, json, step, xml, gltf, vtkjs, vrml, dxf, svg, stl, amf, tjs, ' +
-            'vtp, 3mf, png, pdf (default: file extension, or html if not given)')
+        help='output format, or comma-separated list of formats: ' + ', '.join(BUILD_FORMATS)
+            + ' (default: file extension, or html if not given)')
+    parser_build.add_argument('-j', '--jobs', metavar='N', type=parse_positive_int,
+        help='number of worker processes used when exporting several formats ' +
+            '(default: number of cpus)')
     parser_build.add_argument('-m', '--minify', action='store_true',
         help='minify output when exporting to html')
+    parser_build.add_argument('--thumbnail-sizes', metavar='LIST', type=parse_sizes,
+        default='100', help='comma-separated list of thumbnail widths in pixels, generated ' +
+            'when building a website, the first one is used in the index page (default: 100)')
+    parser_build.add_argument('--thumbnail-dpi', metavar='DPI', type=parse_positive_int,
+        default=96, help='resolution of thumbnails, which are scaled by DPI / 96, ' +
+            'ie. 192 for high density screens (default: 96)')
+    parser_build.add_argument('--prefetch', action='store_true',
+        help='in a website, download a model when its thumbnail is hovered in the index page')
+    parser_build.add_argument('-w', '--watch', action='store_true',
+        help='after the build, watch the target and export again the modules affected by ' +
+            'each change, until interrupted')
+    add_model_options(parser_build)
     add_ui_options(parser_build)
 
     parser_list = subparsers.add_parser('info',
@@ -70,6 +110,70 @@ cq-server build examples/box.png build/box.step # build step file in build/box.s
     return parser.parse_args()
 
 
+def parse_positive_int(value: str) -> int:
+    '''Return a command line value as a strictly positive integer.'''
+
+    try:
+        number = int(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f'invalid integer: { value }') from error
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be greater than 0: { value }')
+
+    return number
+
+
+def parse_non_negative_int(value: str) -> int:
+    '''Return a command line value as a positive integer or 0.'''
+
+    try:
+        number = int(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f'invalid integer: { value }') from error
+
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'must be positive or 0: { value }')
+
+    return number
+
+
+def parse_sizes(value: str) -> List[int]:
+    '''Return a comma-separated list of sizes given in command line as a list of integers.'''
+
+    return [ parse_positive_int(size.strip()) for size in value.split(',') ]
+
+
+def add_model_options(parser: argparse.ArgumentParser):
+    '''Add model options to the parser, that can be used in both run and build sub-commands.'''
+
+    parse_model = parser.add_argument_group('model options')
+    parse_model.add_argument('--quantize', metavar='BITS', type=int, choices=range(0, 17),
+        default=0, help='send models with vertices quantized on BITS bits (1 to 16), ' \
+            + 'compressed normals and indices (default: 0, disabled)')
+    parse_model.add_argument('--profile', action='store_true',
+        help='measure the time and memory spent on each line of the scripts, ' \
+            + 'shown in the viewer (slows builds down)')
+    parse_model.add_argument('--triangle-budget', metavar='N', type=parse_non_negative_int,
+        default=0, help='adapt the tesselation tolerances of each part so a model has ' \
+            + 'about N triangles at most (default: 0, disabled)')
+    parse_model.add_argument('--tesselation-jobs', metavar='N', type=int, default=0,
+        help='tesselate the parts of assemblies in parallel with N worker processes ' \
+            + '(default: 0, disabled)')
+    parse_model.add_argument('--max-build-time', metavar='S', type=float, default=0,
+        help='abort builds lasting more than S seconds (default: 0, no limit)')
+    parse_model.add_argument('--max-build-cpu', metavar='S', type=int, default=0,
+        help='abort builds using more than S seconds of CPU time (default: 0, no limit)')
+    parse_model.add_argument('--max-build-memory', metavar='MB', type=int, default=0,
+        help='abort builds using more than MB megabytes of memory (default: 0, no limit)')
+    parse_model.add_argument('--store', metavar='DIR',
+        help='save models, exported files and thumbnails in this folder, which can be shared ' \
+            + 'with other instances, so a model is never built twice (default: disabled)')
+    parse_model.add_argument('--store-size', metavar='MB', type=int, default=DEFAULT_STORE_SIZE,
+        help='remove the least recently used files of the store when it exceeds this size, ' \
+            + f'0 for unlimited (default: { DEFAULT_STORE_SIZE })')
+
+
 def add_ui_options(parser: argparse.ArgumentParser):
     '''Add ui option to the parser, that can be used in both run and build sub-commands.'''
 
@@ -114,6 +218,71 @@ def get_ui_options(args: argparse.Namespace) -> dict:
     }
 
 
+def get_projects(targets: List[str]) -> Dict[str, str]:
+    '''Return the targets given to the run command as a dictionary of url prefix: target.
+    Targets given as `prefix=target` are served under this prefix, other ones under their name,
+    or at the root if there is only one target.'''
+
+    if len(targets) == 1 and '=' not in targets[0]:
+        return { '': targets[0] }
+
+    projects = {}
+
+    for target in targets:
+        prefix, _separator, target_path = target.rpartition('=')
+        prefix = prefix if prefix else op.splitext(op.basename(op.abspath(target_path)))[0]
+        prefix = '/' + prefix.strip('/')
+
+        if prefix in projects:
+            sys_exit(f'Url prefix { prefix } is used by several targets.')
+
+        projects[prefix] = target_path
+
+    return projects
+
+
+def build(exporter, args: argparse.Namespace, formats: List[str], ui_options: dict) -> None:
+    '''Build the target with the build sub-command arguments, then watch it if required.'''
+
+    if exporter.module_manager.target_is_dir:
+        if not args.dest or args.dest == '-':
+            sys_exit('Destination is mandatory for folder export.')
+
+        if formats:
+            exporter.save_modules(args.dest, formats, ui_options, args.minify, args.jobs,
+                args.watch)
+        else:
+            exporter.build_website(args.dest, ui_options, args.minify, args.thumbnail_sizes,
+                args.thumbnail_dpi, args.prefetch, args.watch)
+        return
+
+    if not formats:
+        has_file_ext = args.dest and '.' in args.dest
+        file_ext = op.splitext(args.dest)[1] if has_file_ext else None
+
+        formats = [ file_ext[1:] if file_ext else 'html' ]
+
+    if len(formats) > 1 and args.dest and ('.' in args.dest or args.dest == '-'):
+        sys_exit('Destination must be a folder when exporting several formats.')
+
+    destinations = {}
+    for file_format in formats:
+        destination = args.dest
+
+        if not destination or not '.' in destination:
+            file_name = f'{ op.splitext(args.target)[0] }.{ file_format }'
+            is_dir = destination and not '.' in destination
+            destination = op.join(destination, op.split(file_name)[1]) if is_dir else file_name
+
+        destinations[file_format] = destination
+
+    exporter.save_to_destinations(destinations, ui_options, args.minify, args.jobs)
+
+    if args.watch:
+        exporter.watch(lambda affected_formats: exporter.save_to_destinations(destinations,
+            ui_options, args.minify, args.jobs, affected_formats))
+
+
 def main() -> None:
     '''Main function, called when using the `cq-server` command.'''
     # pylint: disable=import-outside-toplevel
@@ -133,7 +302,31 @@ def main() -> None:
 
     from .module_manager import ModuleManager
 
-    module_manager = ModuleManager(args.target, should_raise)
+    cache = ModelCache(args.cache_size, args.max_rss) if args.cmd == 'run' else ModelCache()
+    build_limits = BuildLimits(getattr(args, 'max_build_time', 0),
+        getattr(args, 'max_build_cpu', 0), getattr(args, 'max_build_memory', 0))
+    store = FileArtifactStore(args.store, args.store_size) if getattr(args, 'store', None) \
+        else None
+    tesselation_pool = TesselationPool(args.tesselation_jobs) \
+        if getattr(args, 'tesselation_jobs', 0) else None
+
+    if args.cmd == 'run':
+        from threading import BoundedSemaphore
+        from .server import run
+
+        build_slots = BoundedSemaphore(args.max_builds) if args.max_builds else None
+        module_managers = { prefix: ModuleManager(target, should_raise, cache, args.quantize,
+            build_limits, build_slots, store, tesselation_pool, args.triangle_budget,
+            args.profile)
+            for prefix, target in get_projects(args.target).items() }
+
+        run(args.port, module_managers, get_ui_options(args), args.dead, args.prebuild)
+        return
+
+    module_manager = ModuleManager(args.target, should_raise, cache,
+        getattr(args, 'quantize', 0), build_limits, store=store,
+        tesselation_pool=tesselation_pool, triangle_budget=getattr(args, 'triangle_budget', 0),
+        profile=getattr(args, 'profile', False))
 
     if args.cmd == 'info':
         modules = module_manager.get_available_modules().keys()
@@ -142,39 +335,24 @@ def main() -> None:
 
     ui_options = get_ui_options(args)
 
-    if args.cmd == 'run':
-        from .server import run
-
-        run(args.port, module_manager, ui_options, args.dead)
-
     if args.cmd == 'build':
         from .exporter import Exporter
 
         exporter = Exporter(module_manager)
 
-        if module_manager.target_is_dir:
-            if not args.dest:
-                sys_exit('Destination is mandatory for folder export.')
-            if args.format:
-                sys_exit('Format option is not required when target is a directory.')
-            exporter.build_website(args.dest, ui_options, args.minify)
-            return
+        formats = args.format.split(',') if args.format else []
 
-        if not args.format:
-            has_file_ext = args.dest and '.' in args.dest
-            file_ext = op.splitext(args.dest)[1] if has_file_ext else None
+        for file_format in formats:
+            if file_format not in BUILD_FORMATS:
+                sys_exit(f'Bad format: { file_format }, available formats: '
+                    + ', '.join(BUILD_FORMATS) + '.')
 
-            args.format = file_ext[1:] if file_ext else 'html'
-
-        if not args.dest or not '.' in args.dest:
-            file_name = f'{ op.splitext(args.target)[0] }.{ args.format }'
-            is_dir = args.dest and not '.' in args.dest
-            args.dest = op.join(args.dest, op.split(file_name)[1]) if is_dir else file_name
-
-        if args.format == 'html':
-            exporter.save_to_html(args.dest, ui_options, args.minify)
-        else:
-            exporter.save_to(args.dest, args.format)
+        try:
+            build(exporter, args, formats, ui_options)
+        except KeyboardInterrupt:
+            if not args.watch:
+                raise
+            print('\nStopped watching.')
 
 
 if __name__ == '__main__':
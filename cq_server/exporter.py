@@ -4,14 +4,25 @@ import os
 import os.path as op
 import json
 import tempfile
+import traceback
+from io import BytesIO
 from shutil import rmtree
+from time import sleep
+from uuid import uuid4
+from typing import Dict, List, Tuple, Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 
 from jinja2 import Template
+from jinja2.utils import htmlsafe_json_dumps
 import minify_html
 from cadquery import exporters
+from cadquery.occ_impl.exporters.svg import getSVG
 import cairosvg
 
-from .module_manager import ModuleManager
+from .module_manager import ModuleManager, ModuleManagerError, WATCH_PERIOD, get_timestamp
+from .formats import ASSEMBLY_FORMATS, COMPOUND_FORMATS, RENDERED_FORMATS, TESSELATED_FORMATS
 
 
 APP_DIR = op.dirname(__file__)
@@ -28,6 +39,9 @@ DEFAULT_SVG_OPTIONS = {
     'showHidden': True,
     'backgroundColor': '#aaa' # used for rasterization
 }
+DATA_PLACEHOLDER = '__cqs_data__'
+DEFAULT_THUMBNAIL_SIZES = [ 100 ]
+DEFAULT_DPI = 96
 
 
 class Exporter:
@@ -37,52 +51,85 @@ class Exporter:
         self.module_manager = module_manager
         self.module_manager.init()
 
-    def _saving(self, destination: str, file_format: str, save: callable):
+    def _make_parent_dir(self, destination: str):
         if op.dirname(destination) and not op.isdir(op.dirname(destination)):
             os.makedirs(op.dirname(destination))
 
+    def _saving(self, destination: str, file_format: str, save: callable):
+        self._make_parent_dir(destination)
+
         save()
 
         print(f'{ file_format } file exported in { destination }.')
 
+    def _save_bytes_to(self, destination: str, data: bytes):
+        with atomic_destination(destination) as temp_path:
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+
     def _save_data_to(self, destination: str, data: str):
         if destination == '-':
             print(data)
         else:
-            with open(destination, 'w', encoding='utf-8') as file:
-                file.write(data)
+            with atomic_destination(destination) as temp_path:
+                with open(temp_path, 'w', encoding='utf-8') as file:
+                    file.write(data)
 
-    def _save(self, destination: str, file_format: str, options=None) -> str:
+    def _save(self, destination: str, file_format: str, options=None) -> None:
         '''Save the assembly in the given format.'''
 
-        assembly = self.module_manager.get_assembly()
-
-        if file_format not in [ 'step', 'xml' ]:
-            assembly = assembly.toCompound()
-
-        if not options and file_format in [ 'svg', 'png', 'pdf' ]:
-            options = DEFAULT_SVG_OPTIONS
-
-        if file_format in [ 'step', 'xml', 'gltf', 'vtkjs', 'vrml' ]:
+        if file_format in ASSEMBLY_FORMATS:
+            assembly = self.module_manager.get_assembly()
             assembly.save(destination, exportType=file_format.upper())
-        elif file_format in [ 'dxf', 'svg', 'stl', 'amf', 'tjs', 'vtp', '3mf' ]:
-            exporters.export(assembly, destination, file_format.upper(), opt=options)
-        elif file_format in [ 'png' , 'pdf' ]:
-            with tempfile.NamedTemporaryFile() as svg_file:
-                exporters.export(assembly, svg_file.name, 'SVG', opt=options)
-                if file_format == 'png':
-                    cairosvg.svg2png(file_obj=svg_file, write_to=destination, scale=2,
-                        background_color=options.get('backgroundColor', None))
-                else:
-                    cairosvg.svg2pdf(file_obj=svg_file, write_to=destination)
+        elif file_format in COMPOUND_FORMATS + RENDERED_FORMATS:
+            export_compound(self.module_manager.get_compound(), destination, file_format, options)
         else:
             raise NameError(f'bad export format: { file_format }')
 
-    def save_to_html(self, destination: str, ui_options: dict, minify: bool=True):
+    def get_export(self, file_format: str) -> bytes:
+        '''Return the assembly exported in the given format, cached until the module changes
+        and saved in the artifact store.'''
+
+        entry = self.module_manager.get_cache_entry()
+        data = entry.exports.get(file_format)
+
+        if data is not None:
+            return data
+
+        is_stored = file_format not in [ 'json', 'js' ] # the model itself is stored
+        data = self.module_manager.get_artifact(file_format) if is_stored else None
+
+        if data is None:
+            if file_format == 'json':
+                data = self.get_json().encode('utf-8')
+            elif file_format == 'js':
+                data = self.get_js().encode('utf-8')
+            elif file_format in RENDERED_FORMATS:
+                data = render_compound(self.module_manager.get_compound(), file_format)
+            else:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    file_path = op.join(tmp_dir, f'export.{ file_format }')
+                    self._save(file_path, file_format)
+
+                    if not op.isfile(file_path):
+                        # vtkjs scenes are written in a directory, then archived as <path>.zip
+                        file_path += '.zip'
+
+                    with open(file_path, 'rb') as file:
+                        data = file.read()
+
+            if is_stored:
+                self.module_manager.put_artifact(file_format, data)
+
+        self.module_manager.cache.set_export(entry, file_format, data)
+        return data
+
+    def save_to_html(self, destination: str, ui_options: dict, minify: bool=True,
+            modules_hash: Dict[str, str]=None, website_options: dict=None):
         '''Save a static html page that renders the assembly.'''
 
         def save():
-            html = self.get_html(ui_options, minify)
+            html = self.get_html(ui_options, minify, modules_hash, website_options)
             self._save_data_to(destination, html)
 
         self._saving(destination, 'html', save)
@@ -96,7 +143,7 @@ class Exporter:
             elif file_format == 'js' :
                 self._save_data_to(destination, self.get_js())
             else:
-                self._save(destination, file_format)
+                self._save_bytes_to(destination, self.get_export(file_format))
 
         self._saving(destination, file_format, save)
 
@@ -112,56 +159,462 @@ class Exporter:
         json_data = self.get_json()
         return f"modules['{ self.module_manager.module_name }'] = { json_data }"
 
-    def get_html(self, ui_options: dict, minify: bool=True) -> str:
-        '''Return the html string of a page that renders the assembly.'''
+    def get_html(self, ui_options: dict, minify: bool=True,
+            modules_hash: Dict[str, str]=None, website_options: dict=None) -> str:
+        '''Return the html string of a page that renders the assembly. The modules hash is the
+        manifest used by the index page of a static website to load modules on demand, and the
+        website options are the options of this index page (ie. prefetch), which are not
+        passed to the viewer.'''
 
-        viewer_css_path = op.join(STATIC_DIR, 'viewer.css')
-        viewer_js_path = op.join(STATIC_DIR, 'viewer.js')
-        template_path = op.join(TEMPLATES_DIR, 'viewer.html')
+        html_start, html_end = get_html_shell(json.dumps(ui_options, sort_keys=True),
+            tuple(self.module_manager.available_modules.keys()),
+            json.dumps(modules_hash if modules_hash else {}, sort_keys=True),
+            json.dumps(website_options if website_options else {}, sort_keys=True), minify)
+        data_json = str(htmlsafe_json_dumps(self.module_manager.get_data()))
 
-        with open(viewer_css_path, encoding='utf-8') as css_file:
-            viewer_css = '\n' + css_file.read() + '\n'
+        return html_start + data_json + html_end
 
-        with open(viewer_js_path, encoding='utf-8') as js_file:
-            viewer_js = '\n' + js_file.read() + '\n'
+    def save_to_formats(self, destinations: Dict[str, str], ui_options: dict, minify=False,
+            jobs: int=None):
+        '''Build the assembly once, then save it in several formats. Formats that only need
+        the shapes are exported in parallel by worker processes, from a BRep serialization,
+        while the others are exported from the built assembly.
+        Formats found in the artifact store are not exported again.'''
 
-        with open(template_path, encoding='utf-8') as template_file:
-            template = Template(template_file.read())
+        compound_formats = []
+        futures = {}
 
-        html = template.render(
-            static=True,
-            viewer_css=viewer_css,
-            viewer_js=viewer_js,
-            options=ui_options,
-            modules_name=list(self.module_manager.available_modules.keys()),
-            data=self.module_manager.get_data()
-        )
+        for file_format, destination in destinations.items():
+            if file_format not in COMPOUND_FORMATS + RENDERED_FORMATS:
+                continue
+
+            data = self.module_manager.get_artifact(file_format)
+
+            if data is None:
+                compound_formats.append(file_format)
+            else:
+                self._saving(destination, file_format, lambda data=data, destination=destination:
+                    self._save_bytes_to(destination, data))
+
+        brep = BytesIO()
+
+        if compound_formats:
+            self.module_manager.get_compound().exportBrep(brep)
+
+        workers = min(jobs or os.cpu_count(), max(len(compound_formats), 1))
+
+        with ProcessPoolExecutor(workers) as pool:
+            for file_format in compound_formats:
+                destination = destinations[file_format]
+                self._make_parent_dir(destination)
+                futures[file_format] = pool.submit(_export_brep, brep.getvalue(), destination,
+                    file_format)
+
+            for file_format, destination in destinations.items():
+                if file_format not in COMPOUND_FORMATS + RENDERED_FORMATS:
+                    self._save_format(destination, file_format, ui_options, minify)
+
+            for file_format, future in futures.items():
+                future.result()
+                print(f'{ file_format } file exported in { destinations[file_format] }.')
+
+                with open(destinations[file_format], 'rb') as file:
+                    self.module_manager.put_artifact(file_format, file.read())
+
+    def save_to_destinations(self, destinations: Dict[str, str], ui_options: dict,
+            minify=False, jobs: int=None, formats: List[str]=None):
+        '''Save the assembly in the given formats, as format: destination path,
+        or only in the formats of the destinations that are in the given list.'''
+
+        destinations = { file_format: destination
+            for file_format, destination in destinations.items()
+            if not formats or file_format in formats }
+
+        if len(destinations) > 1:
+            self.save_to_formats(destinations, ui_options, minify, jobs)
+        elif destinations:
+            file_format, destination = next(iter(destinations.items()))
+            self._save_format(destination, file_format, ui_options, minify)
+
+    def save_modules(self, destination: str, formats: List[str], ui_options: dict,
+            minify=False, jobs: int=None, watch=False):
+        '''Save all modules in the given formats, in the destination folder, where files are
+        named after the module names. If watch is set, the files are then saved again on each
+        change, until interrupted.'''
+
+        def save_module(affected_formats: List[str]=None) -> None:
+            module_name = self.module_manager.module_name
+            destinations = { file_format: op.join(destination, f'{ module_name }.{ file_format }')
+                for file_format in formats }
+            self.save_to_destinations(destinations, ui_options, minify, jobs, affected_formats)
+
+        def remove_modules(_saved: List[str], removed: List[str]) -> None:
+            for module_name in removed:
+                for file_format in formats:
+                    path = op.join(destination, f'{ module_name }.{ file_format }')
+                    if op.isfile(path):
+                        os.remove(path)
+
+        for module_name in self.module_manager.available_modules.keys():
+            self.module_manager.module_name = module_name
+
+            try:
+                save_module()
+            except Exception as error: # pylint: disable=broad-except
+                if not watch:
+                    raise
+                print_export_error(module_name, error)
+
+        if watch:
+            self.watch(save_module, remove_modules)
+
+    def _save_format(self, destination: str, file_format: str, ui_options: dict, minify=False):
+        if file_format == 'html':
+            self.save_to_html(destination, ui_options, minify)
+        else:
+            self.save_to(destination, file_format)
+
+    def get_thumbnails(self, sizes: List[int], dpi: int=DEFAULT_DPI) -> Dict[int, bytes]:
+        '''Return png thumbnails of the assembly for each given width, in pixels.
+        Thumbnails are cached until the module changes.'''
 
-        if minify:
-            html = minify_html.minify( # pylint: disable=no-member
-                html,
-                minify_js=True,
-                minify_css=True,
-                remove_processing_instructions=True
-            )
+        entry = self.module_manager.get_cache_entry()
+        thumbnails = {}
+        missing_sizes = []
 
-        return html
+        for size in sizes:
+            name = f'png_{ size }_{ dpi }'
+            thumbnails[size] = entry.exports.get(name)
 
-    def build_website(self, destination: str, ui_options: dict, minify=False):
-        '''Build static website containing index page and static files for all modules.'''
+            if thumbnails[size] is not None:
+                continue
+
+            thumbnails[size] = self.module_manager.get_artifact(name)
+
+            if thumbnails[size] is None:
+                missing_sizes.append(size)
+            else:
+                self.module_manager.cache.set_export(entry, name, thumbnails[size])
+
+        if missing_sizes:
+            compound = self.module_manager.get_compound()
+            rendered_thumbnails = render_thumbnails(compound, missing_sizes, dpi)
+
+            for size, thumbnail in rendered_thumbnails.items():
+                self.module_manager.cache.set_export(entry, f'png_{ size }_{ dpi }', thumbnail)
+                self.module_manager.put_artifact(f'png_{ size }_{ dpi }', thumbnail)
+
+            thumbnails.update(rendered_thumbnails)
+
+        return thumbnails
+
+    def save_thumbnails(self, destinations: Dict[int, str], dpi: int=DEFAULT_DPI):
+        '''Save png thumbnails of the assembly, as width in pixels: destination path.'''
+
+        thumbnails = self.get_thumbnails(list(destinations.keys()), dpi)
+
+        for size, destination in destinations.items():
+            self._saving(destination, 'png', lambda thumbnail=thumbnails[size],
+                destination=destination: self._save_bytes_to(destination, thumbnail))
+
+    def build_website(self, destination: str, ui_options: dict, minify=False,
+            thumbnail_sizes: List[int]=None, dpi: int=DEFAULT_DPI, prefetch=False, watch=False):
+        '''Build static website containing index page and static files for all modules.
+        The index page only embeds a manifest of the modules, whose models are loaded on demand.
+        The first thumbnail size is the one displayed in the index page.
+        If watch is set, the website is then updated on each change, until interrupted.'''
 
         if op.isdir(destination):
             rmtree(destination)
 
-        self.save_to_html(op.join(destination, 'index.html'), ui_options, minify)
-
-        js_path = op.join(destination, 'js')
-        png_path = op.join(destination, 'png')
-        stl_path = op.join(destination, 'stl')
+        thumbnail_sizes = thumbnail_sizes if thumbnail_sizes else DEFAULT_THUMBNAIL_SIZES
+        website_options = { 'prefetch': prefetch, 'thumbnail_width': thumbnail_sizes[0] }
 
         for module_name in self.module_manager.available_modules.keys():
             self.module_manager.module_name = module_name
 
-            self.save_to(op.join(js_path, f'{ module_name }.js'), 'js')
-            self.save_to(op.join(png_path, f'{ module_name }.png'), 'png')
-            self.save_to(op.join(stl_path, f'{ module_name }.stl'), 'stl')
+            try:
+                self.save_website_module(destination, thumbnail_sizes, dpi)
+            except Exception as error: # pylint: disable=broad-except
+                if not watch:
+                    raise
+                print_export_error(module_name, error)
+
+        self.save_website_index(destination, ui_options, website_options, minify)
+
+        if not watch:
+            return
+
+        def save_module(formats: List[str]) -> None:
+            self.save_website_module(destination, thumbnail_sizes, dpi, formats)
+
+        def update_index(_saved: List[str], removed: List[str]) -> None:
+            for module_name in removed:
+                for path in get_website_module_paths(destination, module_name, thumbnail_sizes):
+                    if op.isfile(path):
+                        os.remove(path)
+
+            self.save_website_index(destination, ui_options, website_options, minify)
+
+        self.watch(save_module, update_index)
+
+    def save_website_index(self, destination: str, ui_options: dict, website_options: dict,
+            minify=False):
+        '''Save the index page of a static website, which embeds the manifest of the modules.'''
+
+        modules_hash = { module_name: self.module_manager.get_model_hash(module_name)
+            for module_name in self.module_manager.available_modules.keys() }
+
+        self.module_manager.module_name = None
+        self.save_to_html(op.join(destination, 'index.html'), ui_options, minify, modules_hash,
+            website_options)
+
+    def save_website_module(self, destination: str, thumbnail_sizes: List[int],
+            dpi: int=DEFAULT_DPI, formats: List[str]=None):
+        '''Save the static files of the current module in a static website: its model as js,
+        its thumbnails and its stl file, or only the files of the given formats.'''
+
+        js_path, stl_path, *thumbnails_path = get_website_module_paths(destination,
+            self.module_manager.module_name, thumbnail_sizes)
+
+        if not formats or 'js' in formats:
+            self.save_to(js_path, 'js')
+        if not formats or 'png' in formats:
+            self.save_thumbnails(dict(zip(thumbnail_sizes, thumbnails_path)), dpi)
+        if not formats or 'stl' in formats:
+            self.save_to(stl_path, 'stl')
+
+    def get_modules_state(self) -> Dict[str, tuple]:
+        '''Return the state of the available modules, as module name: (sources hash,
+        tesselation options) tuple, or None if the module can not be read.'''
+
+        states = {}
+
+        for module_name in self.module_manager.available_modules.keys():
+            try:
+                options = self.module_manager.get_tesselation_options(module_name)
+                states[module_name] = (self.module_manager.get_sources_hash(module_name),
+                    json.dumps(options, sort_keys=True))
+            except ModuleManagerError as error:
+                print(error.message)
+                states[module_name] = None
+            except OSError:
+                states[module_name] = None
+
+        return states
+
+    def get_watched_files(self) -> Dict[str, float]:
+        '''Return the files that affect the builds of the available modules, ie. the modules,
+        the local modules they import and the config file, as path: timestamp.'''
+
+        paths = { self.module_manager.config.config_file_path }
+
+        for module_name, module_path in self.module_manager.available_modules.items():
+            paths.add(module_path)
+            paths.update(self.module_manager.get_dependencies(module_name))
+
+        return { path: get_timestamp(path) for path in paths }
+
+    def watch(self, save_module: Callable[[List[str]], None],
+            on_modules_update: Callable[[List[str], List[str]], None]=None) -> None:
+        '''Watch the target and save again the modules affected by each change, until
+        interrupted. A module is affected when its source, the source of a local module it
+        imports or its tesselation options change. save_module() is called with the current
+        module set to the affected module, and the list of affected formats, or None if all
+        formats are affected. Then on_modules_update() is called with the names of the saved
+        modules and of the removed modules.'''
+
+        states = self.get_modules_state()
+        watched_files = self.get_watched_files()
+        print('Watching for changes, press Ctrl+C to stop.')
+
+        while True:
+            sleep(WATCH_PERIOD)
+
+            is_index_updated = self.module_manager.update_index()
+            is_updated = any(get_timestamp(path) != timestamp
+                for path, timestamp in watched_files.items())
+
+            if not is_index_updated and not is_updated:
+                continue
+
+            watched_files = self.get_watched_files()
+            new_states = self.get_modules_state()
+            saved = []
+            removed = [ module_name for module_name in states if module_name not in new_states ]
+
+            for module_name, state in new_states.items():
+                previous_state = states.get(module_name)
+
+                if state is None or state == previous_state:
+                    continue
+
+                is_options_update = previous_state is not None and previous_state[0] == state[0]
+                self.module_manager.module_name = module_name
+
+                if module_name in states:
+                    print(f'Module { module_name } updated.')
+
+                try:
+                    save_module(TESSELATED_FORMATS if is_options_update else None)
+                    saved.append(module_name)
+                except Exception as error: # pylint: disable=broad-except
+                    print_export_error(module_name, error)
+
+            states = new_states
+
+            if on_modules_update and (saved or removed):
+                try:
+                    on_modules_update(saved, removed)
+                except Exception as error: # pylint: disable=broad-except
+                    print(f'Can not update the modules: { get_error_message(error) }')
+
+
+def get_website_module_paths(destination: str, module_name: str, thumbnail_sizes: List[int]) \
+        -> List[str]:
+    '''Return the paths of the static files of a module in a static website: its js file,
+    its stl file, then its thumbnails for each given width.'''
+
+    paths = [
+        op.join(destination, 'js', f'{ module_name }.js'),
+        op.join(destination, 'stl', f'{ module_name }.stl'),
+        op.join(destination, 'png', f'{ module_name }.png')
+    ]
+
+    for size in thumbnail_sizes[1:]:
+        paths.append(op.join(destination, 'png', f'{ module_name }_{ size }.png'))
+
+    return paths
+
+
+def print_export_error(module_name: str, error: Exception) -> None:
+    '''Print an error that occured when exporting a module, with its stacktrace.'''
+
+    print(f'Can not export { module_name }: { get_error_message(error) }')
+
+    stacktrace = error.stacktrace if isinstance(error, ModuleManagerError) \
+        else ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+    if stacktrace:
+        print(stacktrace)
+
+
+def get_error_message(error: Exception) -> str:
+    '''Return the message of an error raised when exporting a module.'''
+
+    return error.message if isinstance(error, ModuleManagerError) else f'{ error }'
+
+
+@contextmanager
+def atomic_destination(destination: str) -> Iterator[str]:
+    '''Context manager yielding a temporary path located next to the destination, which is
+    moved to the destination on exit, so the destination is never seen partially written.'''
+
+    temp_path = op.join(op.dirname(destination),
+        f'.{ op.basename(destination) }.{ uuid4().hex[:8] }.tmp')
+
+    try:
+        yield temp_path
+        os.replace(temp_path, destination)
+    finally:
+        if op.isfile(temp_path):
+            os.remove(temp_path)
+
+
+@lru_cache(maxsize=None)
+def read_static_file(file_name: str) -> str:
+    '''Return the content of a static file, read only once.'''
+
+    with open(op.join(STATIC_DIR, file_name), encoding='utf-8') as static_file:
+        return static_file.read()
+
+
+@lru_cache(maxsize=None)
+def get_template() -> Template:
+    '''Return the compiled viewer template.'''
+
+    with open(op.join(TEMPLATES_DIR, 'viewer.html'), encoding='utf-8') as template_file:
+        return Template(template_file.read())
+
+
+@lru_cache(maxsize=32)
+def get_html_shell(options_json: str, modules_name: tuple, modules_hash_json: str,
+        website_options_json: str, minify: bool) -> Tuple[str, str]:
+    '''Return the static html page without the model data, eventually minified,
+    as a tuple of the html parts located before and after the data.'''
+
+    html = get_template().render(
+        static=True,
+        viewer_css='\n' + read_static_file('viewer.css') + '\n',
+        viewer_js='\n' + read_static_file('viewer.js') + '\n',
+        options=json.loads(options_json),
+        modules_name=list(modules_name),
+        modules_hash=json.loads(modules_hash_json),
+        website_options=json.loads(website_options_json),
+        data=DATA_PLACEHOLDER
+    )
+
+    if minify:
+        html = minify_html.minify( # pylint: disable=no-member
+            html,
+            minify_js=True,
+            minify_css=True,
+            remove_processing_instructions=True
+        )
+
+    # the placeholder is rendered as a json string: remove its quotes as well
+    position = html.index(DATA_PLACEHOLDER)
+    return html[:position - 1], html[position + len(DATA_PLACEHOLDER) + 1:]
+
+
+def render_compound(compound, file_format: str, options=None) -> bytes:
+    '''Return a projection of a shape as svg, png or pdf, generated in memory.'''
+
+    options = options if options else DEFAULT_SVG_OPTIONS
+    svg = getSVG(compound, options).encode('utf-8')
+
+    if file_format == 'svg':
+        return svg
+    if file_format == 'png':
+        return cairosvg.svg2png(bytestring=svg, scale=2,
+            background_color=options.get('backgroundColor', None))
+    if file_format == 'pdf':
+        return cairosvg.svg2pdf(bytestring=svg)
+
+    raise NameError(f'bad export format: { file_format }')
+
+
+def render_thumbnails(compound, sizes: List[int], dpi: int=DEFAULT_DPI, options=None) \
+        -> Dict[int, bytes]:
+    '''Return png images of a shape for each given width, in css pixels, all rasterized from
+    a single svg projection. Images are scaled by the ratio of the given resolution to 96 dpi,
+    ie. a thumbnail of 100 pixels is 200 pixels wide at 192 dpi, for high density screens.'''
+
+    options = options if options else DEFAULT_SVG_OPTIONS
+    svg = getSVG(compound, options).encode('utf-8')
+
+    return { size: cairosvg.svg2png(bytestring=svg, output_width=round(size * dpi / DEFAULT_DPI),
+        background_color=options.get('backgroundColor', None)) for size in sizes }
+
+
+def export_compound(compound, destination: str, file_format: str, options=None) -> None:
+    '''Save a shape in a format that doesn't require assembly information.'''
+
+    if file_format not in COMPOUND_FORMATS + RENDERED_FORMATS:
+        raise NameError(f'bad export format: { file_format }')
+
+    with atomic_destination(destination) as temp_path:
+        if file_format in RENDERED_FORMATS:
+            with open(temp_path, 'wb') as file:
+                file.write(render_compound(compound, file_format, options))
+        else:
+            exporters.export(compound, temp_path, file_format.upper(), opt=options)
+
+
+def _export_brep(brep: bytes, destination: str, file_format: str) -> None:
+    '''Save a shape serialized as BRep, used by worker processes.'''
+    # pylint: disable=import-outside-toplevel
+
+    from cadquery import Shape
+
+    export_compound(Shape.importBrep(BytesIO(brep)), destination, file_format)
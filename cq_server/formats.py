@@ -0,0 +1,9 @@
+'''Module formats: define the file formats supported by the exporter, without importing it.'''
+
+
+EXPORT_FORMATS = [ 'json', 'js', 'step', 'xml', 'gltf', 'vtkjs', 'vrml', 'dxf', 'svg', 'stl',
+    'amf', 'tjs', 'vtp', '3mf', 'png', 'pdf' ]
+ASSEMBLY_FORMATS = [ 'step', 'xml', 'gltf', 'vtkjs', 'vrml' ] # need names and colors
+COMPOUND_FORMATS = [ 'dxf', 'stl', 'amf', 'tjs', 'vtp', '3mf' ]
+RENDERED_FORMATS = [ 'svg', 'png', 'pdf' ]
+TESSELATED_FORMATS = [ 'html', 'json', 'js' ] # depend on the tesselation options
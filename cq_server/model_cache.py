@@ -0,0 +1,252 @@
+'''Module model_cache: define the ModelCache class, a memory-bounded cache of built models.'''
+
+import os
+import gc
+import math
+from threading import RLock
+from collections import OrderedDict
+from typing import Dict
+
+
+DEFAULT_CACHE_SIZE = 1024 # in MB
+RSS_MARGIN = 0.1 # part of the max rss kept free after an eviction
+
+# Rough in-memory cost estimations, in bytes:
+SHAPE_BASE_SIZE = 64 * 1024 # OCCT topology of a shape, before being meshed
+SHAPE_VERTEX_SIZE = 24 # a Poly_Triangulation node (3 doubles)
+SHAPE_TRIANGLE_SIZE = 12 # a Poly_Triangulation triangle (3 ints)
+PY_NUMBER_SIZE = 32 # a number in a json-decoded list (object + list slot)
+
+
+class CacheEntry:
+    '''Heavy data related to a module, built from a given version of its source,
+    identified by a build key.'''
+
+    def __init__(self, module_path: str, build_key: str):
+        self.module_path = module_path
+        self.build_key = build_key
+        self.assembly = None
+        self.assembly_size = 0
+        self.compound = None
+        self.model = None
+        self.model_size = 0
+        self.exports = {}
+        self.exports_size = 0
+        self.profile = None
+
+    def get_size(self) -> int:
+        '''Return the estimated memory used by this entry, in bytes.'''
+
+        return self.assembly_size + self.model_size + self.exports_size
+
+    def has(self, data_name: str) -> bool:
+        '''Return True if the entry holds the given data (assembly, exports or model).'''
+
+        data = getattr(self, data_name)
+        return bool(data) if isinstance(data, dict) else data is not None
+
+    def free(self, data_name: str) -> None:
+        '''Remove the given data (assembly, exports or model) from the entry.'''
+
+        setattr(self, data_name, {} if data_name == 'exports' else None)
+        setattr(self, data_name + '_size', 0)
+
+        if data_name == 'assembly':
+            self.compound = None
+
+    def is_empty(self) -> bool:
+        '''Return True if the entry does not hold any data anymore.'''
+
+        return not any(self.has(data_name) for data_name in [ 'assembly', 'model', 'exports' ])
+
+
+class ModelCache:
+    '''Least-recently-used cache of built assemblies, tesselated models and exported files,
+    bounded by a memory budget and optionally by the process resident memory.'''
+
+    def __init__(self, cache_size: int=DEFAULT_CACHE_SIZE, max_rss: int=0):
+        self.budget = cache_size * 1024 * 1024
+        self.max_rss = max_rss * 1024 * 1024
+        self.entries = OrderedDict()
+        self.lock = RLock()
+
+    def get_entry(self, module_path: str, build_key: str) -> CacheEntry:
+        '''Return the cache entry of a module, or a new one if the build key changed.'''
+
+        with self.lock:
+            entry = self.entries.get(module_path)
+
+            if entry is None or entry.build_key != build_key:
+                entry = CacheEntry(module_path, build_key)
+                self.entries[module_path] = entry
+
+            self.entries.move_to_end(module_path)
+            return entry
+
+    def set_assembly(self, entry: CacheEntry, assembly) -> None:
+        '''Store the CadQuery assembly of an entry, then evict data if necessary.'''
+
+        with self.lock:
+            entry.assembly = assembly
+            entry.assembly_size = SHAPE_BASE_SIZE * max(len(assembly.children), 1)
+            self.evict(entry)
+
+    def set_model(self, entry: CacheEntry, model: dict, tesselated=None, stats: tuple=None) \
+            -> None:
+        '''Store the json model of an entry, then evict data if necessary. The size is estimated
+        from the buffers of the tesselated assembly, or from the given tesselation stats.'''
+
+        vertices, triangles, model_size = stats if stats else get_tesselation_stats(tesselated)
+
+        with self.lock:
+            entry.model = model
+            entry.model_size = model_size
+
+            if entry.assembly is not None:
+                entry.assembly_size = SHAPE_BASE_SIZE * max(len(entry.assembly.children), 1) \
+                    + vertices * SHAPE_VERTEX_SIZE + triangles * SHAPE_TRIANGLE_SIZE
+
+            self.evict(entry)
+
+    def set_export(self, entry: CacheEntry, file_format: str, data: bytes) -> None:
+        '''Store an exported file of an entry, then evict data if necessary.'''
+
+        with self.lock:
+            entry.exports[file_format] = data
+            entry.exports_size += len(data)
+            self.evict(entry)
+
+    def evict(self, pinned: CacheEntry=None) -> None:
+        '''Free the least recently used data until the cache fits in the memory limits:
+        OCCT shapes first, then exported files, then tesselated models.
+        The pinned entry is never evicted.'''
+
+        with self.lock:
+            used_size = self.get_used_size()
+            target_size = self.get_target_size(used_size)
+            is_freed = False
+
+            for data_name in [ 'assembly', 'exports', 'model' ]:
+                for entry in list(self.entries.values()):
+                    if used_size <= target_size:
+                        break
+
+                    if entry is pinned or not entry.has(data_name):
+                        continue
+
+                    print(f'Freeing { data_name } of { entry.module_path } from cache.')
+                    used_size -= getattr(entry, data_name + '_size')
+                    entry.free(data_name)
+                    is_freed = True
+
+                    if entry.is_empty():
+                        del self.entries[entry.module_path]
+
+            if is_freed:
+                gc.collect()
+
+    def has_model(self, module_path: str, build_key: str) -> bool:
+        '''Return True if the cache holds the model of the given build of a module.'''
+
+        with self.lock:
+            entry = self.entries.get(module_path)
+            return entry is not None and entry.build_key == build_key \
+                and entry.model is not None
+
+    def clear(self, module_path: str) -> None:
+        '''Remove all data related to a module.'''
+
+        with self.lock:
+            self.entries.pop(module_path, None)
+
+    def get_used_size(self) -> int:
+        '''Return the estimated memory used by the cache, in bytes.'''
+
+        with self.lock:
+            return sum(entry.get_size() for entry in self.entries.values())
+
+    def get_target_size(self, used_size: int) -> float:
+        '''Return the size the cache must fit in, given its current size, in bytes. If the
+        process uses more than the max resident memory, the excess is converted into an amount
+        of cached data to free, with a margin so the resident memory is only checked once per
+        insertion, and not on each insertion once the limit is reached.'''
+
+        target_size = self.budget if self.budget else math.inf
+
+        if self.max_rss:
+            rss = get_rss()
+
+            if rss > self.max_rss:
+                target_size = min(target_size,
+                    used_size - (rss - self.max_rss) - self.max_rss * RSS_MARGIN)
+
+        return target_size
+
+    def get_usage(self) -> Dict[str, int]:
+        '''Return information about the current memory usage, sizes are in bytes.'''
+
+        with self.lock:
+            return {
+                'budget': self.budget,
+                'used': self.get_used_size(),
+                'shapes': sum(entry.assembly_size for entry in self.entries.values()),
+                'meshes': sum(entry.model_size for entry in self.entries.values()),
+                'exports': sum(entry.exports_size for entry in self.entries.values()),
+                'modules': len(self.entries),
+                'rss': get_rss(),
+                'max_rss': self.max_rss
+            }
+
+
+def get_tesselation_stats(tesselated) -> tuple:
+    '''Walk through a tesselated assembly and return its total amount of vertices and triangles,
+    and the estimated memory size of its json-decoded version, in bytes.'''
+
+    if isinstance(tesselated, str):
+        return 0, 0, len(tesselated)
+
+    if isinstance(tesselated, (int, float)):
+        return 0, 0, PY_NUMBER_SIZE
+
+    if isinstance(tesselated, dict):
+        items = tesselated.items()
+    elif isinstance(tesselated, (list, tuple)):
+        items = enumerate(tesselated)
+    else:
+        return 0, 0, getattr(tesselated, 'size', 0) * PY_NUMBER_SIZE
+
+    vertices = triangles = size = 0
+
+    for key, value in items:
+        sub_vertices, sub_triangles, sub_size = get_tesselation_stats(value)
+        size += sub_size
+
+        if key in [ 'vertices', 'triangles' ] and isinstance(value, str):
+            continue # encoded buffer, the amount of items is stored in the *_count keys
+
+        if key == 'vertices':
+            vertices += sub_size // PY_NUMBER_SIZE // 3
+        elif key == 'triangles':
+            triangles += sub_size // PY_NUMBER_SIZE // 3
+        elif key == 'vertex_count':
+            vertices += value
+        elif key == 'triangle_count':
+            if 'triangles' in tesselated: # not the total of the model, stored in its root group
+                triangles += value
+        else:
+            vertices += sub_vertices
+            triangles += sub_triangles
+
+    return vertices, triangles, size
+
+
+def get_rss() -> int:
+    '''Return the resident memory of the current process, in bytes, or 0 if it is not available
+    (ie. on systems without procfs: the peak resident memory given by getrusage() can not be
+    used instead, since it never drops and the whole cache would be freed).'''
+
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
@@ -0,0 +1,87 @@
+'''Module module_config: define the ModuleConfig class, which reads per-module settings.'''
+
+import os.path as op
+import configparser
+
+
+CONFIG_FILE_NAME = '.cqsconfig'
+TESSELATION_OPTIONS = {
+    'triangle_budget': int,
+    'deviation': float,
+    'angular_tolerance': float
+}
+DISABLED_BY_ZERO = [ 'triangle_budget' ]
+
+
+class ModuleConfigError(Exception):
+    '''Error raised when the config file can not be read.'''
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class ModuleConfig:
+    '''Settings of the modules of a folder, read from an ini file located next to the ignore
+    file. Its [DEFAULT] section applies to all modules, other sections to the module having
+    the section name. The file is read again when it changes. For instance:
+
+        [DEFAULT]
+        triangle_budget = 500000
+
+        [frame]
+        deviation = 0.05
+        angular_tolerance = 0.1'''
+
+    def __init__(self, modules_dir: str, defaults: dict=None):
+        self.config_file_path = op.join(modules_dir, CONFIG_FILE_NAME)
+        self.defaults = defaults if defaults else {}
+        self.parser = configparser.ConfigParser()
+        self.timestamp = None
+
+    def update(self) -> None:
+        '''Read the config file if it changed since it was last read.'''
+
+        is_file = op.isfile(self.config_file_path)
+        timestamp = op.getmtime(self.config_file_path) if is_file else 0
+
+        if timestamp == self.timestamp:
+            return
+
+        parser = configparser.ConfigParser()
+
+        if is_file:
+            try:
+                with open(self.config_file_path, encoding='utf-8') as config_file:
+                    parser.read_file(config_file)
+            except configparser.Error as error:
+                raise ModuleConfigError(f'Can not read { CONFIG_FILE_NAME }: { error }') \
+                    from error
+
+        self.parser = parser
+        self.timestamp = timestamp
+
+    def get_tesselation_options(self, module_name: str) -> dict:
+        '''Return the tesselation options of a module: the default options, overridden by the
+        [DEFAULT] section of the config file, then by the section of the module.'''
+
+        self.update()
+
+        section = self.parser[module_name] if self.parser.has_section(module_name) \
+            else self.parser[configparser.DEFAULTSECT]
+        options = { key: self.defaults.get(key) for key in TESSELATION_OPTIONS }
+
+        for key, value_type in TESSELATION_OPTIONS.items():
+            if key in section:
+                try:
+                    options[key] = value_type(section[key])
+                except ValueError as error:
+                    raise ModuleConfigError(f'Bad value for { key } in { CONFIG_FILE_NAME }: '
+                        + f'{ section[key] }') from error
+
+                if options[key] < 0 or (options[key] == 0 and key not in DISABLED_BY_ZERO):
+                    hint = ', or 0 to disable it' if key in DISABLED_BY_ZERO else ''
+                    raise ModuleConfigError(f'Bad value for { key } in { CONFIG_FILE_NAME }: '
+                        + f'{ section[key] } (must be greater than 0{ hint })')
+
+        return options
@@ -0,0 +1,181 @@
+'''Module module_index: define the ModuleIndex class, which lists the modules of a folder.'''
+
+import os
+import os.path as op
+import re
+import ast
+from typing import Dict, List, Tuple
+
+
+IGNORE_FILE_NAME = '.cqsignore'
+IGNORED_FOLDERS = [ '__pycache__', 'node_modules' ]
+
+
+class ModuleIndex:
+    '''Recursive index of the CadQuery scripts of a folder, updated incrementally:
+    only the folders whose modification time changed are scanned again.'''
+
+    def __init__(self, modules_dir: str):
+        self.modules_dir = modules_dir
+        self.modules = {}
+        self.folders = {}
+        self.ignore_matcher = None
+        self.ignore_timestamp = None
+
+    def update(self) -> Tuple[Dict[str, str], Dict[str, str]]:
+        '''Update the index, and return the added modules and the removed modules,
+        as dictionaries of module name: module path.'''
+
+        ignore_file_path = op.join(self.modules_dir, IGNORE_FILE_NAME)
+        ignore_timestamp = op.getmtime(ignore_file_path) if op.isfile(ignore_file_path) else 0
+
+        if ignore_timestamp != self.ignore_timestamp:
+            self.ignore_matcher = compile_ignore_file(ignore_file_path)
+            self.ignore_timestamp = ignore_timestamp
+            self.folders = {}
+
+        folders = {}
+        self._scan_folder('', folders)
+
+        modules = {}
+        for _timestamp, folder_modules, _sub_folders in folders.values():
+            modules.update(folder_modules)
+
+        added = { name: path for name, path in modules.items() if name not in self.modules }
+        removed = { name: path for name, path in self.modules.items() if name not in modules }
+
+        self.folders = folders
+        self.modules = dict(sorted(modules.items()))
+
+        return added, removed
+
+    def _scan_folder(self, folder: str, folders: dict) -> None:
+        '''Scan a folder (relative to the modules dir) and its sub-folders if they changed,
+        and store them in the given dictionary as folder: (timestamp, modules, sub-folders).'''
+
+        folder_path = op.join(self.modules_dir, folder)
+
+        try:
+            timestamp = op.getmtime(folder_path)
+        except OSError:
+            return
+
+        if folder in self.folders and self.folders[folder][0] == timestamp:
+            _timestamp, modules, sub_folders = self.folders[folder]
+        else:
+            modules = {}
+            sub_folders = []
+
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    relative_path = f'{ folder }/{ entry.name }' if folder else entry.name
+
+                    if entry.name.startswith('.') or self.is_ignored(relative_path):
+                        continue
+
+                    if entry.is_dir() and entry.name not in IGNORED_FOLDERS:
+                        sub_folders.append(relative_path)
+                    elif entry.is_file() and entry.name.endswith('.py'):
+                        modules[relative_path[:-3]] = entry.path
+
+        folders[folder] = (timestamp, modules, sub_folders)
+
+        for sub_folder in sub_folders:
+            self._scan_folder(sub_folder, folders)
+
+    def is_ignored(self, relative_path: str) -> bool:
+        '''Return True if the given path, relative to the modules dir, matches an ignore rule.'''
+
+        return bool(self.ignore_matcher) and bool(self.ignore_matcher.match(relative_path))
+
+
+def compile_ignore_file(ignore_file_path: str) -> re.Pattern:
+    '''Compile the patterns of an ignore file into a single regular expression.
+    As in .gitignore files, a pattern without slash matches a file name at any depth,
+    while other patterns match paths relative to the folder of the ignore file.'''
+
+    if not op.isfile(ignore_file_path):
+        return None
+
+    regexes = []
+
+    with open(ignore_file_path, encoding='utf-8') as ignore_file:
+        for line in ignore_file.readlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                pattern = line.strip('/')
+                prefix = '' if '/' in pattern else '(?:.*/)?'
+                regexes.append(prefix + translate_pattern(pattern))
+
+    return re.compile('(?:' + '|'.join(regexes) + r')\Z') if regexes else None
+
+
+def translate_pattern(pattern: str) -> str:
+    '''Translate a glob pattern into a regular expression, where `*` and `?` don't match
+    slashes and `**` matches any number of folders.'''
+
+    regex = ''
+    index = 0
+
+    while index < len(pattern):
+        char = pattern[index]
+
+        if pattern.startswith('**/', index):
+            regex += '(?:.*/)?' # zero or more folders
+            index += 2
+        elif pattern.startswith('**', index):
+            regex += '.*'
+            index += 1
+        elif char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[' and ']' in pattern[index + 1:]:
+            end = pattern.index(']', index + 1)
+            char_class = pattern[index + 1:end]
+            if char_class.startswith('!'):
+                char_class = '^' + char_class[1:]
+            regex += f'[{ char_class }]'
+            index = end
+        else:
+            regex += re.escape(char)
+
+        index += 1
+
+    return regex
+
+
+def get_local_imports(module_path: str, modules_dir: str) -> List[str]:
+    '''Return the paths of the modules located in the modules dir that are imported by a module,
+    including the packages containing them.'''
+
+    try:
+        with open(module_path, encoding='utf-8') as module_file:
+            tree = ast.parse(module_file.read())
+    except (OSError, SyntaxError, ValueError):
+        return []
+
+    imported_names = set()
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [ alias.name for alias in node.names ]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [ node.module ] + [ f'{ node.module }.{ alias.name }' for alias in node.names ]
+        else:
+            continue
+
+        for name in names:
+            parts = name.split('.')
+            imported_names.update(tuple(parts[:length]) for length in range(1, len(parts) + 1))
+
+    paths = []
+
+    for parts in sorted(imported_names):
+        base_path = op.join(modules_dir, *parts)
+
+        for path in [ base_path + '.py', op.join(base_path, '__init__.py') ]:
+            if op.isfile(path):
+                paths.append(path)
+
+    return paths
@@ -3,18 +3,42 @@
 import os
 import os.path as op
 import sys
-from typing import List, Dict, Tuple
-import glob
+from typing import Dict, List, Tuple, Callable
 import json
+import hashlib
+import traceback
+from threading import Semaphore, Lock
+from contextlib import nullcontext
+from functools import lru_cache
+from importlib import metadata
 
+from . import __version__ as cqs_version
+from .model_cache import ModelCache, CacheEntry
+from .module_index import ModuleIndex, get_local_imports
+from .artifact_store import ArtifactStore
+from .module_config import ModuleConfig, ModuleConfigError
+from .tesselation import share_meshes, quantize_meshes, merge_tesselated, copy_shapes, \
+    tesselate_part, get_leaf_parts, get_triangle_budgets, get_triangle_count
+from .build_process import BuildLimits, BuildProcessError, build_objects_in_process
+from .tesselation_pool import TesselationPool
+from .profiler import ScriptProfiler
 
-IGNORE_FILE_NAME = '.cqsignore'
+
+MODEL_ARTIFACT = 'model.json'
+WATCH_PERIOD = 0.3
+
+# sys.modules is shared by all module managers and build threads
+dependencies_lock = Lock()
+dependencies_timestamps = {} # path of a local module: timestamp of its imported version
 
 
 class ModuleManager:
     '''Manage CadQuery scripts (ie. Python modules)'''
 
-    def __init__(self, target: str, should_raise=False):
+    def __init__(self, target: str, should_raise=False, cache: ModelCache=None,
+            quantize_bits: int=0, build_limits: BuildLimits=None, build_slots: Semaphore=None,
+            store: ArtifactStore=None, tesselation_pool: TesselationPool=None,
+            triangle_budget: int=0, profile: bool=False):
         if op.isfile(target):
             self.target_is_dir = False
             self.modules_dir = op.abspath(op.dirname(target))
@@ -28,49 +52,75 @@ class ModuleManager:
 
         self.should_raise = should_raise
         self.last_timestamp = 0
-        self.available_modules = {}
+        self.index = ModuleIndex(self.modules_dir)
+        self.is_initialized = False
+        self.cache = cache if cache else ModelCache()
+        self.quantize_bits = quantize_bits
+        self.build_limits = build_limits
+        self.build_slots = build_slots if build_slots else nullcontext()
+        self.store = store
+        self.tesselation_pool = tesselation_pool
+        self.config = ModuleConfig(self.modules_dir, { 'triangle_budget': triangle_budget })
+        self.profile = profile
+        self.build_profile = None
+        self.sources = {} # module path: (timestamps of the sources, (sources hash, dependencies))
 
     def init(self) -> None:
-        '''Initialize the module manager, in particular import the CadQuery Python module.'''
+        '''Initialize the module manager, in particular import the CadQuery Python module.
+        Does nothing if the module manager is already initialized.'''
         # pylint: disable=unused-import, import-outside-toplevel
 
+        if self.is_initialized:
+            return
+
         print('Importing CadQuery...', end=' ', flush=True)
         import cadquery
         print('done.')
 
         sys.path.insert(1, self.modules_dir)
-        self.available_modules = self.get_available_modules()
+        self.update_index()
+        self.is_initialized = True
+
+    @property
+    def available_modules(self) -> Dict[str, str]:
+        '''Dictionary of available modules as module name: module path.'''
+
+        if self.target_is_dir:
+            return self.index.modules
+
+        return { self.module_name: op.join(self.modules_dir, self.module_name + '.py') }
 
     def get_available_modules(self) -> Dict[str, str]:
-        '''Returns a dictionary of available modules as module name: module path'''
+        '''Update the modules index and returns a dictionary of available modules
+        as module name: module path.'''
+
+        self.update_index()
+        return self.available_modules
 
-        ignored_files_path = self.get_ignored_files_path()
+    def update_index(self) -> bool:
+        '''Update the modules index, return True if modules have been added or removed.'''
 
-        modules_path = []
-        for file_name in os.listdir(self.modules_dir):
-            file_path = op.join(self.modules_dir, file_name)
-            if op.isfile(file_path) \
-                    and op.splitext(file_path)[1] == '.py' \
-                    and file_path not in ignored_files_path:
-                modules_path.append(file_path)
+        if not self.target_is_dir:
+            return False
 
-        return { op.basename(path)[:-3]: path for path in modules_path }
+        is_first_update = not self.index.folders
+        added, removed = self.index.update()
 
-    def get_ignored_files_path(self) -> List[str]:
-        '''Update the list of files ignored, based on the .cqsignore file.'''
+        if not is_first_update:
+            for module_name in added:
+                print(f'Module { module_name } added.')
 
-        ignore_file_path = op.join(self.modules_dir, IGNORE_FILE_NAME)
-        ignored_files_path = []
+        for module_name, module_path in removed.items():
+            print(f'Module { module_name } removed.')
+            self.cache.clear(module_path)
 
-        if op.isfile(ignore_file_path):
-            with open(ignore_file_path, encoding='utf-8') as ignore_file:
-                for line in ignore_file.readlines():
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        ignore = op.join(self.modules_dir, line)
-                        ignored_files_path += glob.glob(ignore)
+        return bool(added or removed)
 
-        return ignored_files_path
+    def get_module_name(self, module_path: str) -> str:
+        '''Return the name of a module from its path, ie. its path relative
+        to the modules dir, without extension.'''
+
+        return op.relpath(module_path, self.modules_dir)[:-3].replace(os.sep, '/')
 
     def get_most_recent_module(self) -> Tuple[str, str]:
         '''Return the last updated module info as a tuple containing its path and timestamp.'''
@@ -107,35 +157,274 @@ class ModuleManager:
 
         return last_updated
 
-    def get_result(self):
+    def get_module_path(self, module_name: str=None) -> str:
+        '''Return the path of the given module, or of the current module.'''
+
+        module_name = module_name if module_name else self.module_name
+
+        if module_name not in self.available_modules:
+            raise ModuleManagerError(f'Module "{ module_name }" not found.')
+
+        return self.available_modules[module_name]
+
+    def get_source(self, module_name: str=None) -> str:
+        '''Return the source code of the given module, or of the current module.'''
+
+        with open(self.get_module_path(module_name), encoding='utf-8') as module_file:
+            return module_file.read()
+
+    def get_source_hash(self, module_name: str=None) -> str:
+        '''Return a hash of the source code of the given module, or of the current module.'''
+
+        return hashlib.sha1(self.get_source(module_name).encode('utf-8')).hexdigest()
+
+    def get_dependencies(self, module_name: str=None) -> List[str]:
+        '''Return the paths of the local modules imported by the given module, or by the current
+        module, directly or through other local modules.'''
+
+        return self.get_sources_info(module_name)[1]
+
+    def get_sources_info(self, module_name: str=None) -> Tuple[str, List[str]]:
+        '''Return the sources hash (see get_sources_hash()) and the dependencies of the given
+        module, or of the current module. They are computed again only when the module
+        or one of its dependencies is modified.'''
+
+        module_path = self.get_module_path(module_name)
+        timestamps, sources_info = self.sources.get(module_path, ({}, None))
+
+        if sources_info and all(get_timestamp(path) == timestamp
+                for path, timestamp in timestamps.items()):
+            return sources_info
+
+        dependencies = self.find_dependencies(module_path)
+        paths = [ module_path ] + dependencies
+        timestamps = { path: get_timestamp(path) for path in paths }
+        digest = hashlib.sha1()
+
+        for path in paths:
+            with open(path, 'rb') as module_file:
+                digest.update(op.relpath(path, self.modules_dir).encode('utf-8'))
+                digest.update(hashlib.sha1(module_file.read()).digest())
+
+        sources_info = (digest.hexdigest(), dependencies)
+        self.sources[module_path] = (timestamps, sources_info)
+        return sources_info
+
+    def find_dependencies(self, module_path: str) -> List[str]:
+        '''Return the paths of the local modules imported by a module, found by parsing it
+        and the local modules it imports.'''
+
+        dependencies = set()
+        paths_to_visit = [ module_path ]
+
+        while paths_to_visit:
+            for path in get_local_imports(paths_to_visit.pop(), self.modules_dir):
+                if path != module_path and path not in dependencies:
+                    dependencies.add(path)
+                    paths_to_visit.append(path)
+
+        return sorted(dependencies)
+
+    def get_build_key(self, module_name: str=None) -> str:
+        '''Return a key identifying a build of the given module, or of the current module,
+        that depends on its source, on the source of the local modules it imports,
+        on its tesselation options and on the CadQuery version.'''
+
+        digest = hashlib.sha1(get_cadquery_version().encode('utf-8'))
+        options = self.get_tesselation_options(module_name)
+        digest.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        digest.update(self.get_sources_hash(module_name).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def get_sources_hash(self, module_name: str=None) -> str:
+        '''Return a hash of the source of the given module, or of the current module,
+        and of the source of the local modules it imports.'''
+
+        return self.get_sources_info(module_name)[0]
+
+    def get_tesselation_options(self, module_name: str=None) -> dict:
+        '''Return the tesselation options of the given module, or of the current module:
+        the triangle budget given to the module manager, overridden by the config file.'''
+
+        try:
+            return self.config.get_tesselation_options(module_name or self.module_name)
+        except ModuleConfigError as error:
+            raise ModuleManagerError(error.message) from error
+
+    def get_model_hash(self, module_name: str=None) -> str:
+        '''Return a hash identifying the model sent to the client, that depends on the module
+        build key and on the settings used to build it. It is also the key of its artifacts.'''
+
+        build_key = self.get_build_key(module_name)
+        settings = f'{ cqs_version }:{ self.quantize_bits }'
+        return hashlib.sha1(f'{ build_key }:{ settings }'.encode('utf-8')).hexdigest()
+
+    def get_cache_entry(self, module_name: str=None) -> CacheEntry:
+        '''Return the cache entry of the given module, or of the current module, reset if its
+        build key has changed.'''
+
+        return self.cache.get_entry(self.get_module_path(module_name),
+            self.get_build_key(module_name))
+
+    def get_artifact(self, name: str, module_name: str=None) -> bytes:
+        '''Return an artifact of the given module, or of the current module, from the artifact
+        store, or None if there is no store or if the artifact is not stored.'''
+
+        return self.store.get(self.get_model_hash(module_name), name) if self.store else None
+
+    def put_artifact(self, name: str, data: bytes, module_name: str=None) -> None:
+        '''Save an artifact of the given module, or of the current module, in the artifact store,
+        if any.'''
+
+        if self.store:
+            self.store.put(self.get_model_hash(module_name), name, data)
+
+    def load_stored_model(self, module_name: str=None) -> list:
+        '''Load the model of the given module, or of the current module, from the artifact store
+        into the cache. Return the model, or None if it was not stored.'''
+
+        model_data = self.get_artifact(MODEL_ARTIFACT, module_name)
+
+        if model_data is None:
+            return None
+
+        model = json.loads(model_data)
+        entry = self.cache.get_entry(self.get_module_path(module_name),
+            self.get_build_key(module_name))
+        self.cache.set_model(entry, model, model)
+        return model
+
+    def get_result(self, module_name: str=None):
         '''Return a CQ assembly object composed of all models passed
-        to show_object and debug functions in the CadQuery script.'''
+        to show_object and debug functions in the CadQuery script of the given module,
+        or of the current module.
+        If profiling is enabled, the profile of the build is saved in build_profile.'''
 
         from cadquery.cqgi import CQModel
 
-        module_script = ''
-        with open(self.available_modules[self.module_name], encoding='utf-8') as module_file:
-            module_script = module_file.read()
+        self.unload_dependencies(module_name)
+        source = self.get_source(module_name)
+        model = CQModel(source)
 
-        model = CQModel(module_script)
-        result = model.build()
+        if self.profile:
+            with ScriptProfiler(source) as profiler:
+                result = model.build()
+            self.build_profile = profiler.get_report()
+        else:
+            result = model.build()
 
         if not result.success:
-            raise ModuleManagerError('Error in model', result.exception)
+            error = result.exception
+            stacktrace = ''.join(traceback.format_exception(type(error), error,
+                error.__traceback__))
+            raise ModuleManagerError('Error in model', stacktrace) from error
 
         return result
 
-    def get_assembly(self):
+    def unload_dependencies(self, module_name: str=None) -> None:
+        '''Remove the local modules imported by the given module, or by the current module,
+        from the imported modules if they have been modified since they were imported, so they
+        are imported again with their current source when the module is built. Modules are only
+        removed after they are modified, so builds running in other threads are not affected
+        otherwise.'''
+
+        modified_paths = set()
+
+        with dependencies_lock:
+            for path in self.get_dependencies(module_name):
+                timestamp = get_timestamp(path)
+
+                if dependencies_timestamps.setdefault(path, timestamp) != timestamp:
+                    dependencies_timestamps[path] = timestamp
+                    modified_paths.add(path)
+
+            if not modified_paths:
+                return
+
+            for name, module in list(sys.modules.items()):
+                module_path = getattr(module, '__file__', None)
+
+                if module_path and op.abspath(module_path) in modified_paths:
+                    del sys.modules[name]
+
+    def get_assembly(self, module_name: str=None):
+        '''Return the CadQuery assembly of the given module, or of the current module,
+        built if not cached. The assembly is returned even if it is evicted from the cache
+        meanwhile (ie. by a concurrent build).'''
+
+        entry = self.get_cache_entry(module_name)
+        assembly = entry.assembly
+
+        if assembly is None:
+            with self.build_slots:
+                assembly = self.build_assembly(module_name)
+
+            self.cache.set_assembly(entry, assembly)
+            entry.profile = self.build_profile
+
+        return assembly
+
+    def get_compound(self):
+        '''Return the shapes of the current module assembly as a single compound.'''
+
+        assembly = self.get_assembly()
+        entry = self.get_cache_entry()
+        compound = entry.compound
+
+        if compound is None:
+            compound = assembly.toCompound()
+
+            if entry.assembly is assembly: # the compound is freed with the assembly
+                entry.compound = compound
+
+        return compound
+
+    def build_assembly(self, module_name: str=None):
+        '''Build the CadQuery script of the given module, or of the current module, and return
+        an assembly containing its objects.
+        If build limits are set, the script is built in a child process.'''
+
         from cadquery import Assembly, Color
 
+        self.build_profile = None
+
+        if self.build_limits and self.build_limits.is_set():
+            try:
+                objects, self.build_profile = build_objects_in_process(
+                    self.get_module_path(module_name),
+                    self.modules_dir, self.build_limits, self.profile)
+            except BuildProcessError as error:
+                raise ModuleManagerError(error.message, error.stacktrace) from error
+        else:
+            objects = self.build_objects(module_name)
+
+        assembly = Assembly()
+
+        for counter, (shape, rgba, name) in enumerate(objects):
+            try:
+                assembly.add(shape, color=Color(*rgba), name=name)
+            except ValueError:
+                assembly.add(shape, color=Color(*rgba), name=f'{ name }_{ counter }')
+
+        return assembly
+
+    def build_objects(self, module_name: str=None) -> List[tuple]:
+        '''Build the CadQuery script of the given module, or of the current module, and return
+        the objects passed to show_object and debug
+        functions, as a list of (object, color, name) tuples, where the object is a shape,
+        a workplane or an assembly, and the color is a rgba tuple.'''
+
+        from cadquery import Color
+
         MODEL_COLOR_DEFAULT = Color(0.9, 0.7, 0.1)
         MODEL_COLOR_DEBUG   = Color(1  , 0  , 0  , 0.2)
 
-        build_result = self.get_result()
+        build_result = self.get_result(module_name)
 
-        assembly = Assembly()
+        objects = []
 
-        for counter, result in enumerate(build_result.results):
+        for result in build_result.results:
             rgb   = result.options.get('color', None)
             alpha = result.options.get('alpha', None)
             name  = result.options.get('name' , None)
@@ -146,50 +435,137 @@ class ModuleManager:
                 else MODEL_COLOR_DEFAULT
 
             if alpha:
-                color = Color(color.toTuple()[:3] + [ alpha ])
+                color = Color(*color.toTuple()[:3], alpha)
 
-            try:
-                assembly.add(result.shape, color=color, name=name)
-            except ValueError:
-                assembly.add(result.shape, color=color, name=f'{ name }_{ counter }')
+            objects.append((result.shape, color.toTuple(), name))
 
         for result in build_result.debugObjects:
-            assembly.add(result.shape, color=MODEL_COLOR_DEBUG)
+            objects.append((result.shape, MODEL_COLOR_DEBUG.toTuple(), None))
 
-        if not assembly.children:
+        if not objects:
             raise ValueError('nothing to show')
 
-        return assembly
+        return objects
+
+    def get_json_model(self, on_part: Callable[[dict], None]=None, module_name: str=None) \
+            -> list:
+        '''Return the tesselated model of the assembly of the given module, or of the current
+        module, as a dictionnary usable by three-cad-viewer.
+        If the model must be tesselated, on_part is called with the data of each part
+        as soon as it is tesselated (see tesselate()).'''
+
+        entry = self.get_cache_entry(module_name)
+        model = entry.model
+
+        if model is None:
+            model = self.load_stored_model(module_name)
 
-    def get_json_model(self) -> list:
-        '''Return the tesselated model of the assembly,
-        as a dictionnary usable by three-cad-viewer.'''
+        if model is None:
+            assembly = self.get_assembly(module_name)
+
+            with self.build_slots:
+                model, assembly_tesselated = self.tesselate(assembly, on_part,
+                    module_name=module_name)
+
+            self.cache.set_model(entry, model, assembly_tesselated)
+            self.put_artifact(MODEL_ARTIFACT, json.dumps(model).encode('utf-8'), module_name)
+
+        return model
+
+    def tesselate(self, assembly, on_part: Callable[[dict], None]=None, options: dict=None,
+            module_name: str=None) -> tuple:
+        '''Tesselate an assembly and return a tuple containing its json-compatible model
+        and its tesselated version, where buffers are numpy arrays.
+        Parts (ie. shapes of the assembly, see get_leaf_parts()) are tesselated separately,
+        in parallel if there is a tesselation pool, and are processed in the assembly order:
+        if on_part is given, it is called with the data of each part as soon as it is tesselated
+        (see get_part_data()), so it can be sent to clients.
+        Options default to the tesselation options of the given module, or of the current
+        module. If a triangle budget
+        is set, it is split between parts, and tolerances are adapted to fit it.'''
 
-        from jupyter_cadquery.cad_objects import to_assembly
-        from jupyter_cadquery.base import _tessellate_group
         from jupyter_cadquery.utils import numpy_to_json
 
+        options = options if options else self.get_tesselation_options(module_name)
+        tolerances = (options['deviation'], options['angular_tolerance'])
+
         try:
-            jcq_assembly = to_assembly(*self.get_assembly().children)
-            assembly_tesselated = _tessellate_group(jcq_assembly)
+            parts = get_leaf_parts(assembly)
+            budgets = get_triangle_budgets(parts, options['triangle_budget']) \
+                if options['triangle_budget'] else [ 0 ] * len(parts)
+            parts_tesselated = []
+
+            if self.tesselation_pool and len(parts) > 1:
+                parts_iterator = self.tesselation_pool.tesselate_parts(parts, tolerances, budgets)
+            else:
+                parts_iterator = (tesselate_part(part, *tolerances, budget)
+                    for part, budget in zip(parts, budgets))
+
+            for index, part_tesselated in enumerate(parts_iterator):
+                parts_tesselated.append(part_tesselated)
+
+                if on_part:
+                    on_part(self.get_part_data(part_tesselated, index, len(parts), module_name))
+
+            assembly_tesselated = merge_tesselated(parts_tesselated)
+            assembly_tesselated[0]['triangle_count'] = get_triangle_count(assembly_tesselated[0])
+            share_meshes(assembly_tesselated[0])
+
+            if self.quantize_bits:
+                quantize_meshes(assembly_tesselated[0], self.quantize_bits)
+
             assembly_json = numpy_to_json(assembly_tesselated)
         except Exception as error:
-            raise ModuleManagerError('An error occured when tesselating the assembly.') from error
+            raise ModuleManagerError('An error occured when tesselating the assembly.') \
+                from error
+
+        return json.loads(assembly_json), assembly_tesselated
+
+    def get_part_data(self, part_tesselated: tuple, index: int, count: int,
+            module_name: str=None) -> dict:
+        '''Return the data to send to the client when a part of the assembly is tesselated,
+        that includes its model (a group containing only this part, whose meshes are not
+        shared with other parts), its amount of triangles, its index and the amount of parts
+        in the assembly.'''
+
+        from jupyter_cadquery.utils import numpy_to_json
 
-        return json.loads(assembly_json)
+        shapes, states = part_tesselated
 
-    def get_data(self) -> dict:
-        '''Return the data to send to the client, that includes the tesselated model.'''
+        if self.quantize_bits:
+            shapes = copy_shapes(shapes)
+            quantize_meshes(shapes, self.quantize_bits)
 
+        return {
+            'module_name': module_name or self.module_name,
+            'index': index,
+            'count': count,
+            'triangle_count': get_triangle_count(shapes),
+            'model': json.loads(numpy_to_json((shapes, states)))
+        }
+
+    def get_data(self, on_part: Callable[[dict], None]=None, module_name: str=None) -> dict:
+        '''Return the data of the given module, or of the current module, to send to the client,
+        that includes the tesselated model. See get_json_model() about on_part.'''
+
+        module_name = module_name or self.module_name
         data = {}
 
-        if self.module_name:
+        if module_name:
             try:
+                model_hash = self.get_model_hash(module_name)
+                model = self.get_json_model(on_part, module_name)
                 data = {
-                    'module_name': self.module_name,
-                    'model': self.get_json_model(),
-                    'source': ''
+                    'module_name': module_name,
+                    'model': model,
+                    'triangle_count': model[0].get('triangle_count'),
+                    'source': '',
+                    'hash': model_hash
                 }
+
+                profile = self.get_cache_entry(module_name).profile
+                if profile:
+                    data['profile'] = profile
             except ModuleManagerError as error:
                 if self.should_raise:
                     raise(error)
@@ -212,6 +588,35 @@ class ModuleManager:
                 + 'at the begining of the script.') from error
 
 
+@lru_cache(maxsize=None)
+def get_cadquery_version() -> str:
+    '''Return the version of the installed CadQuery package.'''
+
+    try:
+        return metadata.version('cadquery')
+    except metadata.PackageNotFoundError:
+        return ''
+
+
+def get_timestamp(path: str) -> float:
+    '''Return the modification time of a file, or 0 if it doesn't exist.'''
+
+    return op.getmtime(path) if op.isfile(path) else 0
+
+
+def to_shape(cq_object):
+    '''Return a CadQuery object as a shape: workplanes are converted to a compound
+    of their shapes.'''
+
+    from cadquery import Shape, Compound
+
+    if isinstance(cq_object, Shape):
+        return cq_object
+
+    return Compound.makeCompound([ value for value in cq_object.vals()
+        if isinstance(value, Shape) ])
+
+
 class ModuleManagerError(Exception):
     '''Error class used to define ModuleManager errors.'''
 
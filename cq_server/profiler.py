@@ -0,0 +1,191 @@
+'''Module profiler: define the ScriptProfiler class, which measures the cost of each line
+of a CadQuery script.'''
+
+import sys
+import tracemalloc
+from threading import Lock
+from time import perf_counter
+from typing import Callable
+
+from .model_cache import get_rss
+
+
+SCRIPT_FILE_NAME = '<cqscript>' # file name given by CQGI to the compiled script
+MAX_PROFILE_LINES = 100
+MAX_PROFILE_CALLS = 50
+
+tracemalloc_lock = Lock()
+tracemalloc_users = 0 # running profilers
+is_tracemalloc_started = False # by profilers, then stopped when the last one exits
+
+
+class ScriptProfiler:
+    '''Context manager measuring, while a CQGI script is built, the wall time and the memory
+    allocated by each line of the script, and by each call from the script to other functions
+    (ie. CadQuery methods). Costs are inclusive: the cost of a line includes the functions it
+    calls. Memory is measured twice: the Python heap is the growth of the memory traced by
+    tracemalloc, which does not include the memory allocated by OCCT, and the resident memory
+    is the growth of the process resident memory, which does (it is 0 on systems without
+    procfs, see get_rss()). Both can be negative when a line frees more memory than it
+    allocates, and include the memory allocated by other threads of the process.
+    The trace function is set for the current thread only, and the previous one (ie. of a
+    debugger) is restored on exit.'''
+
+    def __init__(self, source: str):
+        self.source_lines = source.splitlines()
+        self.lines = {} # line number: [ time, heap, rss, hits ]
+        self.calls = {} # (line number, function name): [ time, heap, rss, count ]
+        self.frames = {} # script frame: (current line number, start time, start memory)
+        self.start_time = 0
+        self.total_time = 0
+        self.peak_heap = 0
+        self.previous_trace = None
+
+    def __enter__(self):
+        global tracemalloc_users, is_tracemalloc_started # pylint: disable=global-statement
+
+        with tracemalloc_lock:
+            if not tracemalloc_users and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                is_tracemalloc_started = True
+            tracemalloc_users += 1
+
+        self.start_time = perf_counter()
+        self.previous_trace = sys.gettrace()
+        sys.settrace(self._trace)
+        return self
+
+    def __exit__(self, *_exception):
+        global tracemalloc_users, is_tracemalloc_started # pylint: disable=global-statement
+
+        sys.settrace(self.previous_trace)
+        self.total_time = perf_counter() - self.start_time
+
+        with tracemalloc_lock:
+            self.peak_heap = tracemalloc.get_traced_memory()[1]
+            tracemalloc_users -= 1
+
+            if not tracemalloc_users and is_tracemalloc_started:
+                tracemalloc.stop()
+                is_tracemalloc_started = False
+
+    def get_report(self) -> dict:
+        '''Return the profile as a json-compatible dictionary, where lines and calls are sorted
+        from the most to the least expensive one. Times are in seconds, memory in bytes.'''
+
+        lines = [
+            {
+                'line': line,
+                'source': self.get_source_line(line),
+                'time': round(time, 6),
+                'heap': heap,
+                'rss': rss,
+                'hits': hits
+            } for line, (time, heap, rss, hits) in self.lines.items()
+        ]
+
+        calls = [
+            {
+                'line': line,
+                'name': name,
+                'time': round(time, 6),
+                'heap': heap,
+                'rss': rss,
+                'count': count
+            } for (line, name), (time, heap, rss, count) in self.calls.items()
+        ]
+
+        return {
+            'total_time': round(self.total_time, 6),
+            'peak_heap': self.peak_heap,
+            'lines': sorted(lines, key=lambda item: -item['time'])[:MAX_PROFILE_LINES],
+            'calls': sorted(calls, key=lambda item: -item['time'])[:MAX_PROFILE_CALLS]
+        }
+
+    def get_source_line(self, line: int) -> str:
+        '''Return the source code of a line of the script.'''
+
+        return self.source_lines[line - 1].strip() if 0 < line <= len(self.source_lines) else ''
+
+    def _trace(self, frame, event: str, _arg) -> Callable:
+        '''Global trace function, called when a frame is started: lines of script frames
+        are traced, as well as the frames called directly from the script.'''
+
+        if event != 'call':
+            return None
+
+        if frame.f_code.co_filename == SCRIPT_FILE_NAME:
+            self.frames[frame] = (None, perf_counter(), get_memory())
+            return self._trace_script
+
+        caller = frame.f_back
+
+        if caller is None or caller.f_code.co_filename != SCRIPT_FILE_NAME:
+            return None
+
+        frame.f_trace_lines = False
+        key = (caller.f_lineno, get_function_name(frame))
+        start_time = perf_counter()
+        start_memory = get_memory()
+
+        def trace_call(_frame, event: str, _arg) -> Callable:
+            if event == 'return':
+                add_cost(self.calls, key, perf_counter() - start_time,
+                    subtract(get_memory(), start_memory))
+            return trace_call
+
+        return trace_call
+
+    def _trace_script(self, frame, event: str, _arg) -> Callable:
+        '''Local trace function of script frames: the cost of a line is measured between
+        the moment it starts and the moment the next line starts or the frame returns.'''
+
+        if event in [ 'line', 'return' ] and frame in self.frames:
+            line, start_time, start_memory = self.frames.pop(frame)
+            time = perf_counter()
+            memory = get_memory()
+
+            if line is not None:
+                add_cost(self.lines, line, time - start_time, subtract(memory, start_memory))
+
+            if event == 'line':
+                self.frames[frame] = (frame.f_lineno, time, memory)
+
+        return self._trace_script
+
+
+def add_cost(costs: dict, key, time: float, memory: tuple) -> None:
+    '''Add the cost of an execution, given its (heap, rss) memory, to a dictionary of
+    [ time, heap, rss, count ] lists.'''
+
+    cost = costs.setdefault(key, [ 0, 0, 0, 0 ])
+    cost[0] += time
+    cost[1] += memory[0]
+    cost[2] += memory[1]
+    cost[3] += 1
+
+
+def get_memory() -> tuple:
+    '''Return the size of the memory blocks currently traced by tracemalloc (ie. the Python
+    heap) and the resident memory of the process, as a (heap, rss) tuple.'''
+
+    return tracemalloc.get_traced_memory()[0], get_rss()
+
+
+def subtract(memory: tuple, start_memory: tuple) -> tuple:
+    '''Return the growth of the (heap, rss) memory since the given start memory.'''
+
+    return memory[0] - start_memory[0], memory[1] - start_memory[1]
+
+
+def get_function_name(frame) -> str:
+    '''Return the qualified name of the function run by a frame, ie. `Workplane.fillet`.'''
+
+    code = frame.f_code
+
+    if hasattr(code, 'co_qualname'):
+        return code.co_qualname
+
+    instance = frame.f_locals.get('self')
+    return f'{ type(instance).__name__ }.{ code.co_name }' if instance is not None \
+        else code.co_name
@@ -0,0 +1,205 @@
+'''Module scheduler: define the PrebuildScheduler class, which warms the model cache.'''
+
+import os
+import sys
+import heapq
+import json
+from threading import Thread, Condition
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+from .module_manager import ModuleManager, ModuleManagerError, MODEL_ARTIFACT
+from .model_cache import get_tesselation_stats
+from .build_process import BuildLimits, get_context
+
+
+PRIORITY_RECENT = 0 # modules that have just been added
+PRIORITY_BACKGROUND = 1
+WORKER_NICENESS = 10
+
+
+class PrebuildScheduler:
+    '''Build and tesselate modules in background worker processes, in order to fill the model
+    cache before modules are requested. Modules are built in priority order, and no build is
+    started while interactive requests are processed. The scheduler can be shared by the module
+    managers of several projects, modules are then identified by their path.'''
+
+    def __init__(self, jobs: int=1):
+        self.jobs = jobs
+        self.queue = []
+        self.modules = {}
+        self.pending = {}
+        self.running = {}
+        self.counter = 0
+        self.active_requests = 0
+        self.condition = Condition()
+        self.pool = None
+
+    def start(self) -> None:
+        '''Start the worker processes and the thread dispatching modules to them.'''
+
+        self.pool = ProcessPoolExecutor(self.jobs, mp_context=get_context(),
+            initializer=_init_worker)
+        Thread(target=self._dispatch, daemon=True).start()
+
+    def restart_pool(self) -> None:
+        '''Replace the worker processes, used when the pool is broken because a worker died
+        (ie. a crash of the OCC kernel, or a process killed when out of memory).'''
+
+        print('A pre-build worker died, restarting the workers.', file=sys.stderr)
+        self.pool.shutdown(wait=False)
+        self.pool = ProcessPoolExecutor(self.jobs, mp_context=get_context(),
+            initializer=_init_worker)
+
+    def schedule(self, module_manager: ModuleManager, modules_name: List[str],
+            priority: int=PRIORITY_BACKGROUND) -> None:
+        '''Add modules to the queue, or move them forward if they have a lower priority.'''
+
+        with self.condition:
+            for module_name in modules_name:
+                module_path = module_manager.available_modules.get(module_name)
+
+                if not module_path or self.pending.get(module_path, priority + 1) <= priority:
+                    continue
+
+                self.modules[module_path] = (module_manager, module_name)
+                self.pending[module_path] = priority
+                self.counter += 1
+                heapq.heappush(self.queue, (priority, self.counter, module_path))
+
+            self.condition.notify_all()
+
+    def schedule_all(self, module_manager: ModuleManager) -> None:
+        '''Add all available modules to the queue, modules already in cache are skipped.'''
+
+        self.schedule(module_manager, list(module_manager.available_modules.keys()))
+
+    @contextmanager
+    def interactive(self, module_manager: ModuleManager, module_name: str=None):
+        '''Context manager used around client requests: no build is started until the request
+        is processed. The requested module (the current module by default) is removed from the
+        queue since the request builds it, or waited for if a worker is already building it,
+        so it is not built twice.'''
+
+        module_path = module_manager.available_modules.get(module_name
+            or module_manager.module_name)
+
+        with self.condition:
+            self.active_requests += 1
+            self.pending.pop(module_path, None)
+            self.condition.wait_for(lambda: module_path not in self.running)
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active_requests -= 1
+                self.condition.notify_all()
+
+    def _dispatch(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue and not self.active_requests
+                    and len(self.running) < self.jobs)
+                priority, _counter, module_path = heapq.heappop(self.queue)
+
+                # modules removed from the queue or moved forward leave outdated items
+                if self.pending.get(module_path) != priority or module_path in self.running:
+                    continue
+
+                del self.pending[module_path]
+                module_manager, module_name = self.modules[module_path]
+
+            try:
+                build_key = module_manager.get_build_key(module_name)
+                model_hash = module_manager.get_model_hash(module_name)
+                options = module_manager.get_tesselation_options(module_name)
+
+                if module_manager.cache.has_model(module_path, build_key) \
+                        or module_manager.load_stored_model(module_name) is not None:
+                    continue
+            except (ModuleManagerError, OSError, ValueError):
+                continue
+
+            try:
+                future = self.pool.submit(_prebuild_module, module_path,
+                    module_manager.modules_dir, module_manager.quantize_bits,
+                    module_manager.build_limits, options, module_manager.profile)
+            except BrokenProcessPool:
+                # the module that crashed the pool is not built again, this one is
+                self.restart_pool()
+                self.schedule(module_manager, [ module_name ], priority)
+                continue
+
+            with self.condition:
+                self.running[module_path] = future
+
+            future.add_done_callback(lambda future, module_path=module_path, \
+                build_key=build_key, model_hash=model_hash: \
+                self._on_built(module_path, build_key, model_hash, future))
+
+    def _on_built(self, module_path: str, build_key: str, model_hash: str, future: Future) \
+            -> None:
+        module_manager, module_name = self.modules[module_path]
+        result = None if future.cancelled() or future.exception() else future.result()
+
+        if result:
+            source_hash, model, stats, profile = result
+
+            try:
+                is_outdated = module_manager.get_source_hash(module_name) != source_hash
+            except (ModuleManagerError, OSError):
+                is_outdated = False
+                result = None
+
+            if is_outdated:
+                self.schedule(module_manager, [ module_name ])
+            elif result:
+                entry = module_manager.cache.get_entry(module_path, build_key)
+                module_manager.cache.set_model(entry, model, stats=stats)
+                entry.profile = profile
+                print(f'Module { module_name } pre-built.')
+
+                if module_manager.store:
+                    module_manager.store.put(model_hash, MODEL_ARTIFACT,
+                        json.dumps(model).encode('utf-8'))
+
+        with self.condition:
+            self.running.pop(module_path, None)
+            self.condition.notify_all()
+
+
+def _init_worker() -> None:
+    '''Initialize a worker process: lower its priority and import CadQuery.'''
+    # pylint: disable=unused-import, import-outside-toplevel
+
+    if hasattr(os, 'nice'):
+        os.nice(WORKER_NICENESS)
+
+    import cadquery
+
+
+def _prebuild_module(module_path: str, modules_dir: str, quantize_bits: int,
+        build_limits: BuildLimits, options: dict, profile: bool) -> tuple:
+    '''Build and tesselate a module in a worker process with the given tesselation options,
+    and return a tuple containing the hash of the built source, the json model, its
+    tesselation stats and the build profile, or None if it failed.'''
+
+    if modules_dir not in sys.path:
+        sys.path.insert(1, modules_dir)
+
+    module_manager = ModuleManager(module_path, True, quantize_bits=quantize_bits,
+        build_limits=build_limits, profile=profile)
+
+    try:
+        source_hash = module_manager.get_source_hash()
+        model, assembly_tesselated = module_manager.tesselate(module_manager.build_assembly(),
+            options=options)
+    except Exception as error: # pylint: disable=broad-except
+        print(f'Pre-build of { module_path } failed: { error }', file=sys.stderr)
+        return None
+
+    return source_hash, model, get_tesselation_stats(assembly_tesselated), \
+        module_manager.build_profile
@@ -1,66 +1,179 @@
 '''Module server: used to run the Flask web server.'''
 
 import json
-from threading import Thread
-from queue import Queue
+import math
+import traceback
+from threading import Thread, Lock
+from contextlib import nullcontext
+from queue import Queue, Full
 from time import sleep
-import os.path as op
-from typing import Tuple
+import mimetypes
+from urllib.parse import quote
+from typing import Dict, List, Callable
 
-from flask import Flask, request, render_template, make_response, Response
+from flask import Flask, Blueprint, request, render_template, make_response, Response
 
-from .module_manager import ModuleManager
+from .module_manager import ModuleManager, ModuleManagerError, WATCH_PERIOD
+from .scheduler import PrebuildScheduler, PRIORITY_RECENT
+from .formats import EXPORT_FORMATS
 
 
-WATCH_PERIOD = 0.3
 SSE_MESSAGE_TEMPLATE = 'event: file_update\ndata: %s\n\n'
+SSE_MODULES_TEMPLATE = 'event: modules_update\ndata: %s\n\n'
+SSE_PART_TEMPLATE = 'event: part_update\ndata: %s\n\n'
+EVENTS_QUEUE_SIZE = 100
+PART_EVENTS_COUNT = EVENTS_QUEUE_SIZE // 2 # maximum amount of part events sent for a model
+EXPORT_CHUNK_SIZE = 64 * 1024
 
 
 app = Flask(__name__, static_url_path='/static')
 
 
-def run(port: int, module_manager: ModuleManager, ui_options: dict, is_dead: bool=False) -> None:
-    '''Run the Flask web server.'''
+def run(port: int, module_managers: Dict[str, ModuleManager], ui_options: dict,
+        is_dead: bool=False, prebuild_jobs: int=0) -> None:
+    '''Run the Flask web server, serving each module manager under its url prefix
+    (an empty prefix serves it at the root). If prebuild jobs are given, all modules
+    are built in background by this amount of worker processes, shared by all projects.'''
 
-    @app.route('/', methods = [ 'GET' ])
+    scheduler = PrebuildScheduler(prebuild_jobs) if prebuild_jobs else None
+
+    for index, (prefix, module_manager) in enumerate(module_managers.items()):
+        blueprint = create_blueprint(f'project_{ index }', module_manager, ui_options,
+            is_dead, scheduler)
+        app.register_blueprint(blueprint, url_prefix=prefix or None)
+
+    if '' not in module_managers:
+        @app.route('/', methods = [ 'GET' ])
+        def _projects() -> str:
+            return render_template('projects.html', prefixes=list(module_managers.keys()))
+
+    if scheduler:
+        scheduler.start()
+
+    app.run(host='0.0.0.0', port=port, debug=False)
+
+
+def create_blueprint(name: str, module_manager: ModuleManager, ui_options: dict,
+        is_dead: bool=False, scheduler: PrebuildScheduler=None) -> Blueprint:
+    '''Create the routes serving the modules of a module manager and start its watchdog.'''
+
+    blueprint = Blueprint(name, __name__)
+
+    @blueprint.route('/', methods = [ 'GET' ])
     def _root() -> str:
         if module_manager.target_is_dir:
             module_manager.module_name = request.args.get('m')
 
+        is_built = True
+
+        if module_manager.module_name:
+            try:
+                is_built = module_manager.get_cache_entry().model is not None
+            except (ModuleManagerError, OSError):
+                pass # errors are handled when building the model
+
+        if module_manager.module_name and not is_built:
+            # the page is sent without waiting for the model, which is streamed from /json
+            data = { 'module_name': module_manager.module_name }
+        else:
+            with interactive():
+                data = module_manager.get_data()
+
         return render_template(
             'viewer.html',
             options=ui_options,
             modules_name=list(module_manager.available_modules.keys()),
-            data=module_manager.get_data()
+            data=data
         )
 
-    @app.route('/html', methods = [ 'GET' ])
+    @blueprint.route('/html', methods = [ 'GET' ])
     def _html() -> str:
-        # pylint: disable=import-outside-toplevel
+        if module_manager.target_is_dir:
+            module_manager.module_name = request.args.get('m')
 
-        from .exporter import Exporter
+        with interactive():
+            return get_exporter().get_html(ui_options)
 
+    @blueprint.route('/json', methods = [ 'GET' ])
+    def _json() -> Response:
         if module_manager.target_is_dir:
             module_manager.module_name = request.args.get('m')
 
-        exporter = Exporter(module_manager)
-        return exporter.get_html(ui_options)
+        module_name = module_manager.module_name
+
+        try:
+            if module_name \
+                    and request.if_none_match.contains(module_manager.get_model_hash(module_name)):
+                return Response(status=304)
+        except (ModuleManagerError, OSError):
+            pass # errors are handled when building the model
+
+        if request.args.get('stream'):
+            return Response(stream_data(module_name), mimetype='application/x-ndjson')
 
-    @app.route('/json', methods = [ 'GET' ])
-    def _json() -> Tuple[str, int]:
+        with interactive(module_name):
+            data = module_manager.get_data(module_name=module_name)
+
+        response = make_response(data, 400 if 'error' in data else 200)
+
+        if 'hash' in data:
+            response.set_etag(data['hash'])
+
+        return response
+
+    @blueprint.route('/export', methods = [ 'GET' ])
+    def _export() -> Response:
         if module_manager.target_is_dir:
             module_manager.module_name = request.args.get('m')
 
-        data = module_manager.get_data()
-        return data, (400 if 'error' in data else 200)
+        file_format = request.args.get('fmt', 'stl')
+        if file_format not in EXPORT_FORMATS:
+            return { 'error': f'bad export format: { file_format }' }, 400
+
+        try:
+            with interactive():
+                data = get_exporter().get_export(file_format)
+        except ModuleManagerError as error:
+            return { 'error': error.message, 'stacktrace': error.stacktrace }, 400
+        except Exception as error: # pylint: disable=broad-except
+            return {
+                'error': f'An error occured when exporting the model as { file_format }: { error }',
+                'stacktrace': traceback.format_exc()
+            }, 500
+
+        def stream():
+            for start in range(0, len(data), EXPORT_CHUNK_SIZE):
+                yield data[start:start + EXPORT_CHUNK_SIZE]
+
+        file_name = f'{ module_manager.module_name.split("/")[-1] }.{ file_format }'
+        ascii_file_name = file_name.encode('ascii', 'replace').decode('ascii') \
+            .replace('"', '_').replace('\\', '_')
+        response = Response(stream(), mimetype=mimetypes.guess_type(file_name)[0]
+            or 'application/octet-stream')
+        response.headers['Content-Disposition'] = f'attachment; filename="{ ascii_file_name }"; ' \
+            + f"filename*=UTF-8''{ quote(file_name) }"
+        return response
+
+    @blueprint.route('/cache', methods = [ 'GET' ])
+    def _cache() -> dict:
+        return module_manager.cache.get_usage()
 
-    @app.route('/events', methods = [ 'GET' ])
+    @blueprint.route('/events', methods = [ 'GET' ])
     def _events() -> Response:
+        events_queue = Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+        with events_lock:
+            events_queues.add(events_queue)
+
         def stream():
-            while True:
-                data = events_queue.get()
-                print(f'Sending Server Sent Event: { data[:100] }...')
-                yield data
+            try:
+                while True:
+                    data = events_queue.get()
+                    print(f'Sending Server Sent Event: { data[:100] }...')
+                    yield data
+            finally:
+                with events_lock:
+                    events_queues.discard(events_queue)
 
         response = make_response(stream())
         response.mimetype = 'text/event-stream'
@@ -68,21 +181,155 @@ def run(port: int, module_manager: ModuleManager, ui_options: dict, is_dead: boo
         response.headers['Expires'] = 0
         return response
 
+    def publish(data: str) -> None:
+        '''Send a server sent event to all connected clients. Events are dropped for clients
+        too slow to read them, which then miss parts and load the whole model instead.'''
+
+        with events_lock:
+            queues = list(events_queues)
+
+        for events_queue in queues:
+            try:
+                events_queue.put_nowait(data)
+            except Full:
+                pass
+
+    def get_streamed_data(on_part: Callable[[dict], None], module_name: str) -> dict:
+        '''Return the data of the given module, while sending each part to on_part as soon
+        as it is tesselated. If parts have been sent, the model is removed from the data,
+        since clients assemble it from the parts.'''
+
+        parts_count = 0
+
+        def send_part(part_data: dict) -> None:
+            nonlocal parts_count
+            parts_count += 1
+            on_part(part_data)
+
+        data = module_manager.get_data(send_part, module_name)
+
+        if parts_count and 'model' in data:
+            data = dict(data, streamed=True)
+            del data['model']
+
+        return data
+
+    def stream_data(module_name: str):
+        '''Build the given module in a thread, and yield its parts as json lines as soon as
+        they are tesselated, then the module data. The module name is given since the current
+        module can be changed by other requests meanwhile.'''
+
+        lines = Queue()
+
+        def build() -> None:
+            try:
+                with interactive(module_name):
+                    data = get_streamed_data(lambda part_data: lines.put(json.dumps(part_data)),
+                        module_name)
+                lines.put(json.dumps(data))
+            finally:
+                lines.put(None)
+
+        Thread(target=build, daemon=True).start()
+
+        while True:
+            line = lines.get()
+            if line is None:
+                break
+            yield line + '\n'
+
+    def get_exporter():
+        # pylint: disable=import-outside-toplevel
+
+        from .exporter import Exporter
+
+        nonlocal exporter
+
+        if not exporter:
+            exporter = Exporter(module_manager)
+
+        return exporter
+
+    def interactive(module_name: str=None):
+        '''Return a context used to build the given module, or the current module, on a client
+        request, which pauses the background builds.'''
+
+        return scheduler.interactive(module_manager, module_name) if scheduler else nullcontext()
+
+    def publish_part(part_data: dict, parts_batch: list) -> None:
+        '''Send a tesselated part to all connected clients. Parts are gathered in the given batch
+        and sent together, so a model fits in PART_EVENTS_COUNT events whatever its amount
+        of parts, and events are not dropped because of the queue size.'''
+
+        parts_batch.append(part_data)
+        batch_size = math.ceil(part_data['count'] / PART_EVENTS_COUNT)
+
+        if len(parts_batch) >= batch_size or part_data['index'] == part_data['count'] - 1:
+            publish(SSE_PART_TEMPLATE % json.dumps(parts_batch))
+            parts_batch.clear()
+
+    def get_changed_modules(build_keys: Dict[str, str]) -> List[str]:
+        '''Return the modules whose build key changed since the last call (ie. added modules,
+        and modules whose source, local dependencies or options changed), and update the given
+        build keys.'''
+
+        changed = []
+
+        for module_name in list(build_keys):
+            if module_name not in module_manager.available_modules:
+                del build_keys[module_name]
+
+        for module_name in list(module_manager.available_modules):
+            try:
+                build_key = module_manager.get_build_key(module_name)
+            except (ModuleManagerError, OSError, ValueError):
+                continue
+
+            if build_keys.get(module_name) != build_key:
+                build_keys[module_name] = build_key
+                changed.append(module_name)
+
+        return changed
+
     def watchdog() -> None:
+        build_keys = {}
+
+        if scheduler and module_manager.target_is_dir:
+            get_changed_modules(build_keys) # modules have been scheduled on startup
+
         while True:
+            if module_manager.update_index():
+                modules_name = list(module_manager.available_modules.keys())
+                publish(SSE_MODULES_TEMPLATE % json.dumps(modules_name))
+
+            if scheduler and module_manager.target_is_dir:
+                scheduler.schedule(module_manager, get_changed_modules(build_keys),
+                    PRIORITY_RECENT)
+
             last_updated_file = module_manager.get_last_updated_file()
 
             if last_updated_file:
-                module_manager.module_name = op.basename(last_updated_file)[:-3]
-                data = module_manager.get_data()
-                events_queue.put(SSE_MESSAGE_TEMPLATE % json.dumps(data))
+                module_name = module_manager.get_module_name(last_updated_file)
+                module_manager.module_name = module_name
+                parts_batch = []
+
+                with interactive(module_name):
+                    data = get_streamed_data(lambda part_data: \
+                        publish_part(part_data, parts_batch), module_name)
+
+                publish(SSE_MESSAGE_TEMPLATE % json.dumps(data))
             sleep(WATCH_PERIOD)
 
-    events_queue = Queue(maxsize = 3)
+    events_queues = set()
+    events_lock = Lock()
+    exporter = None
     module_manager.init()
 
+    if scheduler and module_manager.target_is_dir:
+        scheduler.schedule_all(module_manager)
+
     if not is_dead:
         watchdog_thread = Thread(target=watchdog, daemon=True)
         watchdog_thread.start()
 
-    app.run(host='0.0.0.0', port=port, debug=False)
+    return blueprint
@@ -9,12 +9,34 @@ let modules_name = [];
 let viewer = null;
 let timer = null;
 let sse = null;
+let model_worker = null;
+let last_request_id = 0;
+const pending_requests = {};
+const prefetched_modules = new Set();
+const STREAM_RENDER_PERIOD = 500;
+const PROFILE_ROWS = 10;
+let streamed_model = null;
+let stream_timer = null;
 
 
 function init_sse() {
 	sse = new EventSource('events');
 	sse.addEventListener('file_update', event => {
-		render(JSON.parse(event.data));
+		render_model({ text: event.data });
+	})
+	sse.addEventListener('part_update', event => {
+		// parts are sent by batches, so the events fit in the server queue
+		for (const part_data of JSON.parse(event.data)) {
+			prepare_shapes(part_data.model[0], part_data.model[0].instances);
+			add_part(part_data);
+		}
+	})
+	sse.addEventListener('modules_update', event => {
+		modules_name = JSON.parse(event.data);
+		update_modules_dropdown();
+		if ( ! data.module_name && ! ('error' in data)) {
+			show_index();
+		}
 	})
 	sse.onerror = error => {
 		if (sse.readyState == 2) {
@@ -57,6 +79,7 @@ function init_viewer(_options, _modules_name) {
 function show_error() {
 	document.title = 'error | CadQuery Server';
 	document.getElementById('cqs_index').style.display = 'none';
+	hide_profile();
 
 	document.getElementById('cqs_error_message').innerText = data.error;
 	document.getElementById('cqs_stacktrace').innerText = data.stacktrace;
@@ -68,9 +91,12 @@ function show_error() {
 function show_index() {
 	document.title = 'index | CadQuery Server';
 	document.getElementById('cqs_error').style.display = 'none';
+	hide_profile();
 
 	if (sse) {
-		window.history.pushState('/', '', window.location.origin);
+		const url = new URL(window.location.href);
+		url.searchParams.delete('m');
+		window.history.pushState(url.pathname, '', url.href);
 	}
 
 	const modules_list_dom = document.getElementById('cqs_modules_list');
@@ -93,7 +119,14 @@ function show_index() {
 		} else {
 			const img_dom = document.createElement('img');
 			img_dom.setAttribute('src', `png/${ module_name }.png`);
+			if (website_options.thumbnail_width) {
+				// thumbnails are larger than displayed when generated for high density screens
+				img_dom.setAttribute('width', website_options.thumbnail_width);
+			}
 			img_dom.addEventListener('click', event => render_from_name(module_name));
+			if (website_options.prefetch) {
+				img_dom.addEventListener('mouseenter', event => prefetch_module(module_name));
+			}
 			img_dom.classList.add('cqs_module_item_link');
 
 			const info_dom = document.createElement('div');
@@ -119,15 +152,574 @@ function show_model() {
 	document.getElementById('cqs_error').style.display = 'none';
 	document.getElementById('cqs_index').style.display = 'none';
 
-	if (sse) {
-		const url = new URL(window.location.href);
+	const url = new URL(window.location.href);
+	if (sse && url.searchParams.get('m') != data.module_name) {
 		url.searchParams.set('m', data.module_name);
 		window.history.pushState(url.pathname, '', url.href);
 	}
 
 	const [ shapes, states ] = data.model;
+	prepare_shapes(shapes, shapes.instances);
 	const [ group, tree ] = viewer.renderTessellatedShapes(shapes, states, options);
 	viewer.render(group, tree, states, options);
+
+	if (data.profile) {
+		show_profile(data.profile);
+	} else {
+		hide_profile();
+	}
+}
+
+// Show the time and memory spent on the most expensive lines and calls of the script,
+// measured when the server runs with the --profile option.
+function show_profile(profile) {
+	const format_time = time => `${ time.toFixed(3) } s`;
+	const format_memory = memory => `${ (memory / 1048576).toFixed(1) } MB`;
+
+	const fill_table = (table_dom, headers, rows) => {
+		table_dom.innerHTML = '';
+		for (let row of [ headers ].concat(rows)) {
+			const row_dom = table_dom.insertRow();
+			for (let [ index, cell ] of row.entries()) {
+				const cell_dom = document.createElement(row == headers ? 'th' : 'td');
+				if (row != headers && index == row.length - 1) {
+					const code_dom = document.createElement('code');
+					code_dom.innerText = cell;
+					cell_dom.appendChild(code_dom);
+				} else {
+					cell_dom.innerText = cell;
+				}
+				row_dom.appendChild(cell_dom);
+			}
+		}
+	};
+
+	document.getElementById('cqs_profile_summary').innerText = `Build time: `
+		+ `${ format_time(profile.total_time) }, peak Python heap: ${ format_memory(profile.peak_heap) }.`;
+
+	// the Python heap does not include the memory allocated by OCCT, the resident memory does
+	fill_table(document.getElementById('cqs_profile_lines'),
+		[ 'line', 'time', 'python heap', 'rss', 'hits', 'source' ],
+		profile.lines.slice(0, PROFILE_ROWS).map(line => [ line.line, format_time(line.time),
+			format_memory(line.heap), format_memory(line.rss), line.hits, line.source ]));
+
+	fill_table(document.getElementById('cqs_profile_calls'),
+		[ 'line', 'time', 'python heap', 'rss', 'count', 'function' ],
+		profile.calls.slice(0, PROFILE_ROWS).map(call => [ call.line, format_time(call.time),
+			format_memory(call.heap), format_memory(call.rss), call.count, call.name ]));
+
+	document.getElementById('cqs_profile').style.display = 'block';
+}
+
+function hide_profile() {
+	document.getElementById('cqs_profile').style.display = 'none';
+}
+
+function decode_base64(string, array_type) {
+	const binary = atob(string);
+	const bytes = new Uint8Array(binary.length);
+	for (let i = 0; i < binary.length; i++) {
+		bytes[i] = binary.charCodeAt(i);
+	}
+	return new array_type(bytes.buffer);
+}
+
+// Decode a mesh encoded with the --quantize option (see quantize_mesh() in tesselation.py).
+function decode_mesh(mesh) {
+	const scale = 2 ** mesh.bits - 1;
+	// normals are encoded on 2 to 16 bits
+	const normal_scale = 2 ** (Math.min(Math.max(mesh.bits, 2), 16) - 1) - 1;
+
+	const decode_positions = string => {
+		const quantized = decode_base64(string, mesh.bits <= 8 ? Uint8Array : Uint16Array);
+		const positions = new Float32Array(quantized.length);
+		for (let i = 0; i < quantized.length; i++) {
+			positions[i] = mesh.bb_min[i % 3] + quantized[i] / scale * mesh.bb_size[i % 3];
+		}
+		return positions;
+	};
+
+	const octahedrons = decode_base64(mesh.normals, mesh.bits <= 8 ? Int8Array : Int16Array);
+	const normals = new Float32Array(mesh.vertex_count * 3);
+	for (let i = 0; i < mesh.vertex_count; i++) {
+		let x = octahedrons[2 * i] / normal_scale;
+		let y = octahedrons[2 * i + 1] / normal_scale;
+		const z = 1 - Math.abs(x) - Math.abs(y);
+		if (z < 0) {
+			[ x, y ] = [ (1 - Math.abs(y)) * (x >= 0 ? 1 : -1), (1 - Math.abs(x)) * (y >= 0 ? 1 : -1) ];
+		}
+		const length = Math.hypot(x, y, z) || 1;
+		normals.set([ x / length, y / length, z / length ], 3 * i);
+	}
+
+	const index_type = { 1: Uint8Array, 2: Uint16Array, 4: Uint32Array }[mesh.index_bytes];
+	const zigzags = decode_base64(mesh.triangles, index_type);
+	const triangles = new Uint32Array(zigzags.length);
+	let index = 0;
+	for (let i = 0; i < zigzags.length; i++) {
+		index += (zigzags[i] >>> 1) ^ -(zigzags[i] & 1);
+		triangles[i] = index;
+	}
+
+	return {
+		vertices: decode_positions(mesh.vertices),
+		normals: normals,
+		triangles: triangles,
+		edges: decode_positions(mesh.edges)
+	};
+}
+
+function to_typed_mesh(mesh) {
+	if (mesh.encoding == 'quantized') {
+		return decode_mesh(mesh);
+	}
+	return {
+		vertices: new Float32Array(mesh.vertices.flat()),
+		normals: new Float32Array(mesh.normals.flat()),
+		triangles: new Uint32Array(mesh.triangles.flat()),
+		edges: new Float32Array(mesh.edges.flat(2))
+	};
+}
+
+// Decode encoded meshes, and replace mesh references by the shared meshes,
+// so identical parts use the same buffers.
+function prepare_shapes(shapes, instances) {
+	if (instances) {
+		for (let i = 0; i < instances.length; i++) {
+			if ( ! (instances[i].vertices instanceof Float32Array)) {
+				instances[i] = to_typed_mesh(instances[i]);
+			}
+		}
+	}
+	for (let part of shapes.parts) {
+		if (part.parts) {
+			prepare_shapes(part, instances);
+		} else if (part.shape && part.shape.ref !== undefined) {
+			part.shape = instances[part.shape.ref];
+		} else if (part.shape && (part.shape.encoding || Array.isArray(part.shape.triangles))) {
+			part.shape = to_typed_mesh(part.shape);
+		}
+	}
+}
+
+// Read a fetch response as text, while reporting the amount of loaded bytes.
+// If on_line is given, each line is passed to it as soon as it is received.
+function read_response(response, on_progress, on_line) {
+	if ( ! response.body || ! response.body.getReader) {
+		return response.text().then(text => on_line ? read_lines(text + '\n', on_line) : text);
+	}
+	const total = Number(response.headers.get('Content-Length')) || 0;
+	const reader = response.body.getReader();
+	const decoder = new TextDecoder();
+	let text = '';
+	let loaded = 0;
+
+	const read = () => reader.read().then(({ done, value }) => {
+		if (done) {
+			text += decoder.decode();
+			return on_line ? read_lines(text + '\n', on_line) : text;
+		}
+		loaded += value.length;
+		text += decoder.decode(value, { stream: true });
+		if (on_line) {
+			text = read_lines(text, on_line);
+		}
+		on_progress(loaded, total);
+		return read();
+	});
+	return read();
+}
+
+// Pass the complete lines of a text to on_line, and return the remaining text.
+function read_lines(text, on_line) {
+	let start = 0;
+	let end = text.indexOf('\n');
+	while (end != -1) {
+		if (end > start) {
+			on_line(text.slice(start, end));
+		}
+		start = end + 1;
+		end = text.indexOf('\n', start);
+	}
+	return text.slice(start);
+}
+
+// Return the array buffers of the decoded meshes, which can be transfered between threads.
+function get_buffers(shapes) {
+	const buffers = new Set();
+	const add_mesh = mesh => {
+		for (let key of [ 'vertices', 'normals', 'triangles', 'edges' ]) {
+			if (mesh[key] && mesh[key].buffer instanceof ArrayBuffer) {
+				buffers.add(mesh[key].buffer);
+			}
+		}
+	};
+	const add_parts = group => {
+		for (let part of group.parts || []) {
+			part.parts ? add_parts(part) : part.shape && add_mesh(part.shape);
+		}
+	};
+	add_parts(shapes);
+	return Array.from(buffers);
+}
+
+function open_models_db() {
+	return new Promise((resolve, reject) => {
+		const request = indexedDB.open('cq_server_models', 1);
+		request.onupgradeneeded = () => {
+			request.result.createObjectStore('models', { keyPath: 'key' });
+			request.result.createObjectStore('entries', { keyPath: 'key' });
+		};
+		request.onsuccess = () => resolve(request.result);
+		request.onerror = () => reject(request.error);
+	});
+}
+
+// Run an action on the object stores of the models database, and resolve its result.
+function models_db_transaction(db, mode, action) {
+	return new Promise((resolve, reject) => {
+		const transaction = db.transaction([ 'models', 'entries' ], mode);
+		const request = action(transaction.objectStore('models'), transaction.objectStore('entries'));
+		transaction.oncomplete = () => resolve(request ? request.result : undefined);
+		transaction.onerror = () => reject(transaction.error);
+	});
+}
+
+function get_cached_model(db, key) {
+	return models_db_transaction(db, 'readwrite', (models, entries) => {
+		const request = models.get(key);
+		request.onsuccess = () => {
+			if (request.result) {
+				entries.put({ key: key, size: request.result.size, last_access: Date.now() });
+			}
+		};
+		return request;
+	});
+}
+
+// Store a decoded model, then remove the least recently used models
+// until the cache fits in its size limit.
+function put_cached_model(db, key, hash, model_data, size) {
+	const max_size = 256 * 1048576;
+
+	return models_db_transaction(db, 'readwrite', (models, entries) => {
+		models.put({ key: key, hash: hash, size: size, data: model_data });
+		entries.put({ key: key, size: size, last_access: Date.now() });
+
+		const request = entries.getAll();
+		request.onsuccess = () => {
+			const sorted_entries = request.result.sort((a, b) => b.last_access - a.last_access);
+			let total_size = 0;
+			for (let entry of sorted_entries) {
+				total_size += entry.size;
+				if (total_size > max_size && entry.key != key) {
+					models.delete(entry.key);
+					entries.delete(entry.key);
+				}
+			}
+		};
+	});
+}
+
+// Return the url of the script containing the model of a module, in the static website.
+function get_module_script_url(module_name) {
+	return new URL(`js/${ module_name }.js`, document.baseURI).href;
+}
+
+// Load the script containing the model of a module in the main thread, in the static website.
+function load_module_script(module_name) {
+	return new Promise((resolve, reject) => {
+		const script_dom = document.createElement('script');
+		script_dom.src = get_module_script_url(module_name);
+		script_dom.onload = () => resolve(modules[module_name]);
+		script_dom.onerror = () => reject(`Can not load the model of module ${ module_name }.`);
+		document.head.append(script_dom);
+	});
+}
+
+// Ask the browser to download the script of a module in advance, without evaluating it.
+function prefetch_module(module_name) {
+	if (modules[module_name] || prefetched_modules.has(module_name)) {
+		return;
+	}
+	prefetched_modules.add(module_name);
+
+	const link_dom = document.createElement('link');
+	link_dom.rel = 'prefetch';
+	link_dom.href = get_module_script_url(module_name);
+	document.head.append(link_dom);
+}
+
+// Main function of the model worker, which fetches, parses and decodes models
+// outside of the main thread, then sends them back with their buffers transfered.
+// In the static website, module scripts are imported by the worker itself.
+// Decoded models are kept in IndexedDB, by module, along with their hash: a model is not
+// downloaded again if the hash is known and unchanged, or if the server answers 304.
+// When a model is streamed, each part is sent back as soon as it is received.
+function model_worker_main() {
+	onmessage = message => {
+		const request = message.data;
+		const post_progress = (stage, loaded, total) => {
+			postMessage({ id: request.id, stage: stage, loaded: loaded, total: total });
+		};
+		const get_key = module_name => `${ request.cache_prefix }|${ module_name }`;
+		const post_part = part_data => {
+			const shapes = part_data.model[0];
+			prepare_shapes(shapes, shapes.instances);
+			postMessage({ id: request.id, part: part_data }, get_buffers(shapes));
+		};
+		let db = null;
+		let cached = null;
+
+		const use_cache = request.cache_prefix !== undefined && typeof indexedDB != 'undefined';
+		(use_cache ? open_models_db().catch(() => null) : Promise.resolve(null))
+			.then(_db => {
+				db = _db;
+				return db && request.module_name ? get_cached_model(db, get_key(request.module_name)) : null;
+			})
+			.then(_cached => {
+				cached = _cached || null;
+				if (cached && request.hash && cached.hash == request.hash) {
+					return null;
+				}
+				if (request.url) {
+					const headers = cached ? { 'If-None-Match': `"${ cached.hash }"` } : {};
+					// streamed responses contain a json line per part, then the module data
+					let streamed_data = null;
+					const on_line = line => {
+						const line_data = JSON.parse(line);
+						if (line_data.count === undefined) {
+							streamed_data = line_data;
+						} else {
+							post_part(line_data);
+						}
+					};
+					const url = request.stream ? `${ request.url }&stream=1` : request.url;
+					return fetch(url, { headers: headers, cache: 'no-store' })
+						.then(response => response.status == 304 ? null : read_response(response,
+							(loaded, total) => post_progress('downloading', loaded, total),
+							request.stream ? on_line : null))
+						.then(content => request.stream && content !== null ? streamed_data : content);
+				}
+				if (request.script) {
+					post_progress('downloading', 0, 0);
+					self.modules = {};
+					importScripts(request.script);
+					return self.modules[request.module_name];
+				}
+				return request.text === undefined ? request.data : request.text;
+			})
+			.then(content => {
+				if (content === null) {
+					postMessage({ id: request.id, data: cached.data }, get_buffers(cached.data.model[0]));
+					return;
+				}
+
+				post_progress('parsing', 0, 0);
+				const model_data = typeof content == 'string' ? JSON.parse(content) : content;
+				let buffers = [];
+
+				if (model_data.model) {
+					post_progress('decoding', 0, 0);
+					const shapes = model_data.model[0];
+					prepare_shapes(shapes, shapes.instances);
+					buffers = get_buffers(shapes);
+
+					if (db && model_data.hash) {
+						const size = buffers.reduce((total, buffer) => total + buffer.byteLength, 0);
+						put_cached_model(db, get_key(model_data.module_name), model_data.hash,
+							model_data, size).catch(error => console.log(error));
+					}
+				}
+				postMessage({ id: request.id, data: model_data }, buffers);
+			})
+			.catch(error => postMessage({ id: request.id, error: error.toString() }));
+	};
+}
+
+function get_model_worker() {
+	if (model_worker == null) {
+		model_worker = false;
+		try {
+			const functions = [ decode_base64, decode_mesh, to_typed_mesh, prepare_shapes,
+				read_response, read_lines, get_buffers, open_models_db, models_db_transaction, get_cached_model,
+				put_cached_model ];
+			const source = functions.map(func => func.toString()).join('\n')
+				+ `\n(${ model_worker_main.toString() })();`;
+			const blob = new Blob([ source ], { type: 'text/javascript' });
+
+			model_worker = new Worker(URL.createObjectURL(blob));
+			model_worker.onmessage = on_worker_message;
+			model_worker.onerror = on_worker_error;
+		} catch(error) { console.log(error) }
+	}
+	return model_worker;
+}
+
+// The worker can not be started (ie. blob workers blocked by a content security policy):
+// it is disabled and pending requests are rejected, so they are loaded by the main thread.
+function on_worker_error(error) {
+	model_worker = false;
+	for (const [ request_id, pending_request ] of Object.entries(pending_requests)) {
+		delete pending_requests[request_id];
+		pending_request.reject(error.message || 'The model worker can not be started.');
+	}
+}
+
+function on_worker_message(message) {
+	const response = message.data;
+	const pending_request = pending_requests[response.id];
+
+	if ( ! pending_request) {
+		return;
+	}
+	if (response.part) {
+		if (response.id == last_request_id) {
+			add_part(response.part);
+		}
+		return;
+	}
+	if (response.stage) {
+		if (response.id == last_request_id) {
+			show_progress(response.stage, response.loaded, response.total);
+		}
+		return;
+	}
+
+	delete pending_requests[response.id];
+	if (response.error) {
+		pending_request.reject(response.error);
+	} else {
+		// models loaded after a more recent request are dropped
+		pending_request.resolve(response.id == last_request_id ? response.data : null);
+	}
+}
+
+// Load a model given as an url to fetch, a json text, or an already parsed object.
+// The model is prepared by the model worker, or by the main thread if workers are not available
+// or if the worker fails.
+function load_model(request) {
+	const request_id = ++last_request_id;
+	const worker = get_model_worker();
+	show_progress('loading', 0, 0);
+
+	if ( ! worker) {
+		return load_model_in_main_thread(request, request_id);
+	}
+
+	return new Promise((resolve, reject) => {
+		pending_requests[request_id] = { resolve: resolve, reject: reject };
+		// the worker is loaded from a blob, so relative urls must be resolved here
+		const url = request.url ? new URL(request.url, document.baseURI).href : undefined;
+		worker.postMessage(Object.assign({ id: request_id, cache_prefix: window.location.pathname },
+			request, { url: url }));
+	}).catch(error => {
+		// ie. module scripts can not be imported by the worker when the page is opened from a file
+		console.warn(`The model worker failed (${ error }), loading the model in the main thread.`);
+		return request_id == last_request_id ? load_model_in_main_thread(request, request_id) : null;
+	});
+}
+
+function load_model_in_main_thread(request, request_id) {
+	const get_data = request.url
+		? fetch(request.url).then(response => response.json())
+		: request.script ? load_module_script(request.module_name)
+		: Promise.resolve(request.text === undefined ? request.data : JSON.parse(request.text));
+	return get_data.then(_data => request_id == last_request_id ? _data : null);
+}
+
+function render_model(request) {
+	load_model(request)
+		.then(_data => {
+			if (_data && _data.streamed) {
+				_data = complete_streamed_model(_data);
+			}
+			if (_data) {
+				render(_data);
+			}
+		})
+		.catch(error => console.error(error))
+		.finally(() => {
+			if (Object.keys(pending_requests).length == 0) {
+				hide_progress();
+			}
+		});
+}
+
+// Add a part of a model being tesselated, and render the parts received so far.
+// Parts are sent in the assembly order, the first one starts a new model. A part is a shape
+// wrapped in its ancestor groups, which are merged with the ones of the previous parts.
+function add_part(part_data) {
+	const [ shapes, states ] = part_data.model;
+
+	if (part_data.index == 0 || ! streamed_model || streamed_model.module_name != part_data.module_name) {
+		streamed_model = {
+			module_name: part_data.module_name,
+			count: part_data.count,
+			received: 0,
+			shapes: Object.assign({}, shapes, { parts: [] }),
+			groups: new Map(),
+			states: {}
+		};
+	}
+	merge_parts(streamed_model.shapes, shapes.parts, streamed_model.groups);
+	Object.assign(streamed_model.states, states);
+	streamed_model.received += 1;
+	show_progress('tesselating', streamed_model.received, streamed_model.count, 'parts');
+
+	if ( ! stream_timer) {
+		stream_timer = setTimeout(() => {
+			stream_timer = null;
+			if (streamed_model) {
+				render({ module_name: streamed_model.module_name,
+					model: [ streamed_model.shapes, streamed_model.states ] });
+			}
+		}, STREAM_RENDER_PERIOD);
+	}
+}
+
+// Add the parts of a tesselated group to a group of the streamed model, where sub-groups are merged
+// into the already received group having the same id (ie. an ancestor shared by several parts).
+function merge_parts(group, parts, groups) {
+	for (const part of parts) {
+		if ( ! part.parts) {
+			group.parts.push(part);
+			continue;
+		}
+		if ( ! groups.has(part.id)) {
+			groups.set(part.id, Object.assign({}, part, { parts: [] }));
+			group.parts.push(groups.get(part.id));
+		}
+		merge_parts(groups.get(part.id), part.parts, groups);
+	}
+}
+
+// Return the data of a streamed model, whose model is assembled from the received parts.
+// If some parts have been missed, the whole model is loaded instead and null is returned.
+function complete_streamed_model(_data) {
+	const model = streamed_model;
+	streamed_model = null;
+	clearTimeout(stream_timer);
+	stream_timer = null;
+
+	if (model && model.module_name == _data.module_name && model.received == model.count) {
+		return Object.assign({ model: [ model.shapes, model.states ] }, _data);
+	}
+	render_from_name(_data.module_name);
+	return null;
+}
+
+function show_progress(stage, loaded, total, unit) {
+	const size = unit ? ` (${ loaded }/${ total } ${ unit })`
+		: loaded ? ` (${ (loaded / 1048576).toFixed(1) } MB)` : '';
+	document.getElementById('cqs_progress_text').innerText = `${ stage } model${ size }...`;
+	document.getElementById('cqs_progress_bar').style.width = total ? `${ 100 * loaded / total }%` : '100%';
+	document.getElementById('cqs_progress_bar').classList.toggle('cqs_indeterminate', ! total);
+	document.getElementById('cqs_progress').style.display = 'block';
+}
+
+function hide_progress() {
+	document.getElementById('cqs_progress').style.display = 'none';
 }
 
 function render(_data) {
@@ -147,6 +739,9 @@ function render(_data) {
 
 	if ('error' in data) {
 		show_error();
+	} else if (data.module_name && ! data.model) {
+		// the model has not been built yet when the page was sent
+		render_from_name(data.module_name);
 	} else if (data.module_name) {
 		show_model();
 		try {
@@ -159,12 +754,14 @@ function render(_data) {
 
 function render_from_name(module_name) {
 	if(sse) {
-		fetch(`json?m=${ module_name }`)
-			.then(response => response.json())
-			.then(_data => render(_data))
-			.catch(error => console.error(error));
+		render_model({ url: `json?m=${ module_name }`, module_name: module_name, stream: true });
+	} else if (modules[module_name]) {
+		const module_data = modules[module_name];
+		render_model({ data: module_data, module_name: module_name, hash: module_data.hash });
 	} else {
-		render(modules[module_name]);
+		// the model is loaded on demand, unless the browser cache has the same version
+		render_model({ script: get_module_script_url(module_name), module_name: module_name,
+			hash: modules_hash[module_name] });
 	}
 }
 
@@ -0,0 +1,339 @@
+'''Module tesselation: define functions that tesselate the parts of assemblies,
+and post-process tesselated assemblies.'''
+
+import math
+import base64
+import hashlib
+from typing import Iterator, List
+
+import numpy as np
+
+
+# default tolerances of jupyter-cadquery, where the deviation is relative to the shape size
+DEFAULT_DEVIATION = 0.1
+DEFAULT_ANGULAR_TOLERANCE = 0.2
+MAX_DEVIATION = 2
+MAX_ANGULAR_TOLERANCE = 1
+ADAPTIVE_PASSES = 3
+MIN_NORMAL_BITS = 2 # a signed integer of 1 bit can not encode a normal
+
+
+def tesselate_part(child, deviation: float=None, angular_tolerance: float=None,
+        triangle_budget: int=0) -> tuple:
+    '''Tesselate a child of a CadQuery assembly as a group containing only this part, and return
+    it as a (shapes, states) tuple. Tolerances default to the jupyter-cadquery ones.
+    If the part has more triangles than the given budget, it is tesselated again with coarser
+    tolerances: the amount of triangles is roughly inversely proportional to the deviation,
+    and to the square of the angular tolerance.'''
+    # pylint: disable=import-outside-toplevel
+
+    from jupyter_cadquery.cad_objects import to_assembly
+    from jupyter_cadquery.base import _tessellate_group
+
+    tolerances = { 'deviation': deviation, 'angular_tolerance': angular_tolerance }
+
+    for _pass in range(ADAPTIVE_PASSES):
+        part_tesselated = _tessellate_group(to_assembly(child), dict(tolerances))
+        triangles = get_triangle_count(part_tesselated[0])
+
+        deviation = DEFAULT_DEVIATION if tolerances['deviation'] is None \
+            else tolerances['deviation']
+        angular_tolerance = DEFAULT_ANGULAR_TOLERANCE if tolerances['angular_tolerance'] is None \
+            else tolerances['angular_tolerance']
+
+        if not triangle_budget or triangles <= triangle_budget \
+                or (deviation >= MAX_DEVIATION and angular_tolerance >= MAX_ANGULAR_TOLERANCE):
+            break
+
+        ratio = triangles / triangle_budget
+        tolerances = {
+            'deviation': min(deviation * ratio, MAX_DEVIATION),
+            'angular_tolerance': min(angular_tolerance * math.sqrt(ratio), MAX_ANGULAR_TOLERANCE)
+        }
+
+    return part_tesselated
+
+
+def get_leaf_parts(assembly) -> List:
+    '''Split a CadQuery assembly into parts containing a single shape each, in the assembly
+    order, so nested assemblies can be tesselated shape by shape. The shape of a sub-assembly
+    is wrapped in copies of its ancestors (without their other children), so it keeps its
+    accumulated location, its inherited color and its path in the assembly tree.'''
+
+    parts = []
+
+    for child in assembly.children:
+        parts += iter_leaf_parts(child)
+
+    return parts
+
+
+def iter_leaf_parts(node, ancestors: tuple=()) -> Iterator:
+    '''Iterate over the parts of a sub-assembly (see get_leaf_parts()): its own shape first,
+    then the shapes of its children.'''
+    # pylint: disable=import-outside-toplevel
+
+    from cadquery import Assembly
+
+    if node.obj is not None or not (node.children or ancestors):
+        part = node if not (node.children or ancestors) \
+            else Assembly(node.obj, loc=node.loc, name=node.name, color=node.color)
+
+        for ancestor in reversed(ancestors):
+            group = Assembly(None, loc=ancestor.loc, name=ancestor.name, color=ancestor.color)
+            group.add(part)
+            part = group
+
+        yield part
+
+    for child in node.children:
+        yield from iter_leaf_parts(child, ancestors + (node,))
+
+
+def get_part_shape(part):
+    '''Return the shape of a part returned by get_leaf_parts().'''
+
+    while part.obj is None and part.children:
+        part = part.children[0]
+
+    return part.obj
+
+
+def get_triangle_budgets(parts: List, triangle_budget: int) -> List[int]:
+    '''Split a triangle budget between the parts of a CadQuery assembly (see get_leaf_parts()),
+    proportionally to the square of their bounding box diagonal (ie. roughly to their visible
+    surface), so large shapes get more triangles than small ones whatever the model scale.'''
+
+    weights = []
+
+    for part in parts:
+        try:
+            weights.append(get_part_shape(part).BoundingBox().DiagonalLength ** 2)
+        except Exception: # pylint: disable=broad-except
+            weights.append(0)
+
+    total_weight = sum(weights)
+
+    if not total_weight:
+        return [ max(1, triangle_budget // len(parts)) for _part in parts ]
+
+    return [ max(1, round(triangle_budget * weight / total_weight)) for weight in weights ]
+
+
+def get_triangle_count(shapes: dict) -> int:
+    '''Return the amount of triangles of a tesselated shapes tree, before meshes are shared.'''
+
+    count = 0
+
+    for leaf in iter_leaves(shapes):
+        mesh = leaf['shape']
+        count += mesh['triangle_count'] if 'triangle_count' in mesh \
+            else len(flatten(mesh['triangles'])) // 3
+
+    return count
+
+
+def iter_leaves(shapes: dict) -> Iterator[dict]:
+    '''Iterate over the leaves of a tesselated shapes tree, ie. the parts containing a mesh.'''
+
+    for part in shapes.get('parts', []):
+        if 'parts' in part:
+            yield from iter_leaves(part)
+        elif isinstance(part.get('shape'), dict) and 'triangles' in part['shape']:
+            yield part
+
+
+def merge_tesselated(groups: List[tuple]) -> tuple:
+    '''Merge tesselated groups sharing the same root (ie. the parts of an assembly tesselated
+    separately) into a single tesselated group, as a (shapes, states) tuple. Sub-groups having
+    the same id (ie. the ancestors shared by several parts) are merged into one.'''
+
+    shapes = dict(groups[0][0], parts=[])
+    states = {}
+    groups_by_id = {}
+
+    for group_shapes, group_states in groups:
+        merge_parts(shapes, group_shapes.get('parts', []), groups_by_id)
+        states.update(group_states)
+
+    bounding_boxes = [ group_shapes['bb'] for group_shapes, _states in groups
+        if isinstance(group_shapes.get('bb'), dict) ]
+
+    if bounding_boxes:
+        shapes['bb'] = { key: (min if 'min' in key else max)(bb[key] for bb in bounding_boxes)
+            for key in bounding_boxes[0] }
+
+    return shapes, states
+
+
+def merge_parts(group: dict, parts: List[dict], groups_by_id: dict) -> None:
+    '''Add tesselated parts to a group of a merged tree, where sub-groups are merged into the
+    already added group having the same id, if any. Added groups are copied, so the merged
+    trees are not altered.'''
+
+    for part in parts:
+        if 'parts' not in part:
+            group['parts'].append(part)
+            continue
+
+        if part.get('id') not in groups_by_id:
+            groups_by_id[part.get('id')] = dict(part, parts=[])
+            group['parts'].append(groups_by_id[part.get('id')])
+
+        merge_parts(groups_by_id[part.get('id')], part['parts'], groups_by_id)
+
+
+def copy_shapes(shapes: dict) -> dict:
+    '''Return a copy of a tesselated shapes tree whose meshes can be replaced (ie. quantized)
+    without altering the original tree. Mesh buffers are not copied.'''
+
+    shapes = dict(shapes)
+
+    if 'parts' in shapes:
+        shapes['parts'] = [ copy_shapes(part) for part in shapes['parts'] ]
+    elif isinstance(shapes.get('shape'), dict):
+        shapes['shape'] = dict(shapes['shape'])
+
+    return shapes
+
+
+def get_mesh_digest(mesh: dict) -> str:
+    '''Return a digest of the buffers of a mesh, used to detect identical meshes.'''
+
+    digest = hashlib.sha1()
+
+    for key in sorted(mesh.keys()):
+        digest.update(key.encode('utf-8'))
+        update_digest(digest, mesh[key])
+
+    return digest.hexdigest()
+
+
+def update_digest(digest, value) -> None:
+    '''Feed a hash object with a mesh buffer, which can be a numpy array or a nested list.'''
+
+    if isinstance(value, (list, tuple)) and value and not np.isscalar(value[0]):
+        digest.update(str(len(value)).encode('utf-8'))
+        for item in value:
+            update_digest(digest, item)
+    else:
+        array = np.ascontiguousarray(value)
+        digest.update(f'{ array.dtype }{ array.shape }'.encode('utf-8'))
+        digest.update(array.tobytes())
+
+
+def share_meshes(shapes: dict) -> int:
+    '''Find parts of a tesselated assembly having identical meshes (ie. the same shape placed
+    at different locations), store their mesh once in the `instances` list of the root group
+    and replace it in each part by a reference, as `{ 'ref': <index in instances> }`.
+    Return the number of meshes that have been shared.'''
+
+    leaves_by_digest = {}
+
+    for leaf in iter_leaves(shapes):
+        leaves_by_digest.setdefault(get_mesh_digest(leaf['shape']), []).append(leaf)
+
+    instances = []
+
+    for leaves in leaves_by_digest.values():
+        if len(leaves) < 2:
+            continue
+
+        instances.append(leaves[0]['shape'])
+        for leaf in leaves:
+            leaf['shape'] = { 'ref': len(instances) - 1 }
+
+    if instances:
+        shapes['instances'] = instances
+
+    return len(instances)
+
+
+def quantize_meshes(shapes: dict, bits: int) -> None:
+    '''Replace the meshes of a tesselated assembly by their quantized version.'''
+
+    meshes = [ leaf['shape'] for leaf in iter_leaves(shapes) ] + shapes.get('instances', [])
+
+    for mesh in meshes:
+        quantized_mesh = quantize_mesh(mesh, bits)
+        mesh.clear()
+        mesh.update(quantized_mesh)
+
+
+def quantize_mesh(mesh: dict, bits: int) -> dict:
+    '''Return a compact version of a mesh, where buffers are encoded in base64:
+    - vertices and edges are quantized on `bits` bits, relative to the mesh bounding box;
+    - normals are octahedron-encoded on two signed integers of `bits` bits;
+    - triangle indices are delta and zigzag encoded, in the smallest fitting integer type.'''
+
+    vertices = np.asarray(mesh['vertices'], dtype=np.float32).reshape(-1, 3)
+    normals = np.asarray(mesh['normals'], dtype=np.float32).reshape(-1, 3)
+    triangles = np.asarray(mesh['triangles'], dtype=np.int64).reshape(-1)
+    edges = flatten(mesh.get('edges', [])).reshape(-1, 3)
+
+    points = np.concatenate([ vertices, edges ]) if len(edges) else vertices
+    bb_min = points.min(axis=0) if len(points) else np.zeros(3)
+    bb_size = (points.max(axis=0) - bb_min) if len(points) else np.ones(3)
+    bb_size[bb_size == 0] = 1
+
+    position_type = '<u1' if bits <= 8 else '<u2'
+    normal_type = '<i1' if bits <= 8 else '<i2'
+
+    def quantize_positions(positions: np.ndarray) -> str:
+        quantized = np.round((positions - bb_min) / bb_size * (2 ** bits - 1))
+        return encode_buffer(quantized.astype(position_type))
+
+    deltas = np.diff(triangles, prepend=0)
+    zigzags = (deltas << 1) ^ (deltas >> 63)
+    index_bytes = 1 if zigzags.max(initial=0) < 2 ** 8 \
+        else 2 if zigzags.max(initial=0) < 2 ** 16 else 4
+
+    return {
+        'encoding': 'quantized',
+        'bits': bits,
+        'bb_min': bb_min.tolist(),
+        'bb_size': bb_size.tolist(),
+        'vertex_count': len(vertices),
+        'triangle_count': len(triangles) // 3,
+        'index_bytes': index_bytes,
+        'vertices': quantize_positions(vertices),
+        'edges': quantize_positions(edges),
+        'normals': encode_buffer(octahedron_encode(normals, bits).astype(normal_type)),
+        'triangles': encode_buffer(zigzags.astype(f'<u{ index_bytes }'))
+    }
+
+
+def octahedron_encode(normals: np.ndarray, bits: int) -> np.ndarray:
+    '''Project unit vectors on an octahedron unfolded as a square, then quantize them
+    as pairs of signed integers of the given amount of bits, from 2 to 16.'''
+
+    norms = np.abs(normals).sum(axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    projected = normals / norms
+
+    x_coords, y_coords, z_coords = projected[:, 0], projected[:, 1], projected[:, 2]
+    x_signs = np.where(x_coords >= 0, 1, -1)
+    y_signs = np.where(y_coords >= 0, 1, -1)
+    folded = z_coords < 0
+
+    encoded = np.stack([
+        np.where(folded, (1 - np.abs(y_coords)) * x_signs, x_coords),
+        np.where(folded, (1 - np.abs(x_coords)) * y_signs, y_coords)
+    ], axis=1)
+
+    return np.round(encoded * (2 ** (min(max(bits, MIN_NORMAL_BITS), 16) - 1) - 1))
+
+
+def flatten(buffer) -> np.ndarray:
+    '''Return a flat float32 numpy array from a numpy array or a nested list of arrays.'''
+
+    if isinstance(buffer, (list, tuple)) and buffer and not np.isscalar(buffer[0]):
+        return np.concatenate([ flatten(item) for item in buffer ])
+
+    return np.asarray(buffer, dtype=np.float32).reshape(-1)
+
+
+def encode_buffer(array: np.ndarray) -> str:
+    '''Return a numpy array as a base64 string.'''
+
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')
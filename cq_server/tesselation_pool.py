@@ -0,0 +1,70 @@
+'''Module tesselation_pool: define the TesselationPool class, which tesselates the parts of
+an assembly in parallel.'''
+
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List
+
+from .build_process import get_context, serialize_object, deserialize_object
+from .tesselation import tesselate_part
+
+
+class TesselationPool:
+    '''Pool of worker processes tesselating the parts of assemblies (ie. their shapes wrapped in
+    their ancestors, see get_leaf_parts()). Parts are sent to workers as serialized assemblies,
+    and their tesselations are returned in the assembly order, so they can be merged back into
+    the tree expected by the viewer. The pool can be shared by several module managers,
+    worker processes are started on first use.'''
+
+    def __init__(self, jobs: int):
+        self.jobs = jobs
+        self.executor = None
+        self.lock = Lock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        '''Return the process pool, started if necessary.'''
+
+        with self.lock:
+            if not self.executor:
+                self.executor = ProcessPoolExecutor(self.jobs, mp_context=get_context(),
+                    initializer=_init_worker)
+
+            return self.executor
+
+    def tesselate_parts(self, parts: List, tolerances: tuple, budgets: List[int]) \
+            -> Iterator[tuple]:
+        '''Tesselate the parts of a CadQuery assembly in the worker processes, with the given
+        (deviation, angular tolerance) tuple and triangle budget of each part (see
+        tesselate_part()), and yield their tesselated groups as (shapes, states) tuples,
+        in the order of the parts.'''
+
+        executor = self.get_executor()
+        futures = [ executor.submit(_tesselate_part, serialize_object(part), tolerances, budget)
+            for part, budget in zip(parts, budgets) ]
+
+        try:
+            for future in futures:
+                yield future.result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None # a new pool is started on next use
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _init_worker() -> None:
+    '''Initialize a worker process: import CadQuery and jupyter-cadquery.'''
+    # pylint: disable=unused-import, import-outside-toplevel
+
+    import cadquery
+    import jupyter_cadquery.base
+
+
+def _tesselate_part(part: dict, tolerances: tuple, triangle_budget: int) -> tuple:
+    '''Tesselate a part of an assembly in a worker process.'''
+
+    return tesselate_part(deserialize_object(part), *tolerances, triangle_budget)
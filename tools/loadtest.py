@@ -0,0 +1,475 @@
+'''LoadTest is a tool used to measure the server behavior when several viewers are connected
+while scripts are edited, in order to catch performance and concurrency regressions.
+
+It runs cq-server on a copy of a fixture folder, then simulates concurrent clients, each one
+loading the viewer page and its assets, listening the server sent events and polling models,
+while a driver rewrites scripts at a given rate. It reports request latencies, the delay
+between a script save and the reception of its update event, the dropped events, and the
+memory used by the server over time.
+
+Usage: python tools/loadtest.py examples --clients 20 --duration 60 --rate 0.5'''
+
+import os
+import os.path as op
+import re
+import sys
+import json
+import math
+import shlex
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import http.client
+from subprocess import Popen, STDOUT, TimeoutExpired
+from threading import Thread, Event, Lock
+from time import sleep, time
+from random import Random
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+from cq_server.module_index import ModuleIndex # pylint: disable=wrong-import-position
+
+
+DEFAULT_PORT = 5055
+STARTUP_TIMEOUT = 120
+REQUEST_TIMEOUT = 300
+RSS_PERIOD = 1
+ASSET_PATTERN = re.compile(r'(?:src|href)="(/static/[^"]+)"')
+PERCENTILES = [ 0.5, 0.95, 0.99 ]
+
+
+class Recorder:
+    '''Thread-safe container of the measures taken during a load test.'''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.saves = []
+        self.events = {}
+        self.rss = []
+
+    def add_request(self, endpoint: str, duration: float, is_error: bool) -> None:
+        '''Record the duration of a request, in seconds.'''
+
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(duration)
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + int(is_error)
+
+    def add_save(self, module_name: str) -> None:
+        '''Record that a script has just been saved.'''
+
+        with self.lock:
+            self.saves.append((time(), module_name))
+
+    def add_event(self, client_id: int, module_name: str) -> None:
+        '''Record that a client has just received the update event of a module.'''
+
+        with self.lock:
+            self.events.setdefault(client_id, []).append((time(), module_name))
+
+    def add_rss(self, timestamp: float, rss: int) -> None:
+        '''Record the resident memory of the server processes, in bytes.'''
+
+        with self.lock:
+            self.rss.append((timestamp, rss))
+
+    def get_event_stats(self, clients_amount: int) -> tuple:
+        '''Match each save with the first update event of the same module received after it,
+        for each client, and return the list of delays and the amount of unmatched saves.'''
+
+        lags = []
+        dropped = 0
+
+        for client_id in range(clients_amount):
+            events = self.events.get(client_id, [])
+
+            for save_time, module_name in self.saves:
+                lag = next((event_time - save_time for event_time, event_module in events
+                    if event_module == module_name and event_time >= save_time), None)
+
+                if lag is None:
+                    dropped += 1
+                else:
+                    lags.append(lag)
+
+        return lags, dropped
+
+
+class Client:
+    '''A simulated viewer, which loads the page and its assets, listens the server sent
+    events and polls the model of a module, as the web viewer does.'''
+
+    def __init__(self, load_test, client_id: int):
+        self.load_test = load_test
+        self.client_id = client_id
+        self.random = Random(client_id)
+        self.etags = {}
+        self.sse_connection = None
+
+    def start(self) -> None:
+        '''Start the threads of the client.'''
+
+        Thread(target=self.listen, daemon=True).start()
+        Thread(target=self.browse, daemon=True).start()
+
+    def stop(self) -> None:
+        '''Close the event stream, which ends the listening thread.'''
+
+        if self.sse_connection and self.sse_connection.sock:
+            try:
+                self.sse_connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def browse(self) -> None:
+        '''Load the page, then poll modules until the end of the test.'''
+
+        stopped = self.load_test.stopped
+        self.load_page()
+
+        while not stopped.is_set():
+            stopped.wait(self.random.expovariate(1 / self.load_test.poll_period))
+
+            if self.random.random() < self.load_test.reload_ratio:
+                self.load_page()
+            else:
+                self.poll_model(self.random.choice(self.load_test.modules_name))
+
+    def load_page(self) -> None:
+        '''Load the viewer page and the assets it refers to.'''
+
+        status, body = self.load_test.request('/', 'GET /')
+
+        if status == 200:
+            for asset_url in sorted(set(ASSET_PATTERN.findall(body.decode('utf-8')))):
+                self.load_test.request(asset_url, 'GET /static')
+
+    def poll_model(self, module_name: str) -> None:
+        '''Request the model of a module, revalidating the previous response if any.'''
+
+        headers = { 'If-None-Match': self.etags[module_name] } if module_name in self.etags \
+            else {}
+        status, body = self.load_test.request(f'/json?m={ module_name }', 'GET /json',
+            headers, [ 200, 304 ])
+
+        if status == 200:
+            self.etags[module_name] = f'"{ json.loads(body).get("hash", "") }"'
+
+    def listen(self) -> None:
+        '''Read the server sent events and record the module updates.'''
+
+        self.sse_connection = http.client.HTTPConnection('localhost', self.load_test.port,
+            timeout=REQUEST_TIMEOUT)
+
+        try:
+            self.sse_connection.request('GET', '/events')
+            response = self.sse_connection.getresponse()
+            event_type = ''
+
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+
+                line = line.decode('utf-8').rstrip('\n')
+
+                if line.startswith('event: '):
+                    event_type = line[len('event: '):]
+                elif line.startswith('data: ') and event_type == 'file_update':
+                    data = json.loads(line[len('data: '):])
+                    self.load_test.recorder.add_event(self.client_id,
+                        data.get('module_name', ''))
+        except (OSError, http.client.HTTPException) as error:
+            if not self.load_test.stopped.is_set():
+                print(f'Client { self.client_id }: event stream closed ({ error }).')
+        finally:
+            self.sse_connection.close()
+
+
+class LoadTest:
+    '''Main class of the LoadTest tool.'''
+
+    def __init__(self, args: argparse.Namespace):
+        self.fixture_dir = op.abspath(args.fixture)
+        self.port = args.port
+        self.clients_amount = args.clients
+        self.duration = args.duration
+        self.grace_period = args.grace
+        self.save_rate = args.rate
+        self.poll_period = args.poll_period
+        self.reload_ratio = args.reload_ratio
+        self.server_args = shlex.split(args.server_args)
+        self.output = args.output
+
+        self.recorder = Recorder()
+        self.stopped = Event()
+        self.random = Random(0)
+        self.work_dir = None
+        self.modules_dir = None
+        self.modules_name = []
+        self.server = None
+
+    def run(self) -> None:
+        '''Run the load test and print its report.'''
+
+        self.work_dir = tempfile.mkdtemp(prefix='cqs_loadtest_')
+        self.modules_dir = op.join(self.work_dir, 'modules')
+        shutil.copytree(self.fixture_dir, self.modules_dir)
+
+        modules, _removed = ModuleIndex(self.modules_dir).update()
+        self.modules_name = sorted(modules.keys())
+
+        if not self.modules_name:
+            sys.exit(f'No module found in { self.fixture_dir }.')
+
+        try:
+            self.start_server()
+            Thread(target=self.sample_rss, daemon=True).start()
+
+            clients = [ Client(self, client_id) for client_id in range(self.clients_amount) ]
+            for client in clients:
+                client.start()
+
+            print(f'Running { self.clients_amount } clients for { self.duration } seconds...')
+            self.drive(modules)
+
+            print(f'Waiting { self.grace_period } seconds for the last events...')
+            sleep(self.grace_period)
+            self.stopped.set()
+
+            for client in clients:
+                client.stop()
+        finally:
+            self.stop_server()
+
+        self.report()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def start_server(self) -> None:
+        '''Start cq-server on the copy of the fixture folder, and wait until it responds.'''
+
+        command = [ sys.executable, '-m', 'cq_server.cli', 'run', self.modules_dir,
+            '--port', str(self.port) ] + self.server_args
+        log_path = op.join(self.work_dir, 'server.log')
+
+        print(f'Starting server: { " ".join(command) }')
+        with open(log_path, 'w', encoding='utf-8') as log_file:
+            self.server = Popen(command, stdout=log_file, stderr=STDOUT,
+                cwd=op.dirname(op.dirname(op.abspath(__file__))))
+
+        start_time = time()
+        while time() - start_time < STARTUP_TIMEOUT:
+            if self.server.poll() is not None:
+                break
+
+            try:
+                connection = http.client.HTTPConnection('localhost', self.port, timeout=1)
+                connection.request('GET', '/cache')
+                connection.getresponse().read()
+                connection.close()
+                return
+            except OSError:
+                sleep(0.2)
+
+        with open(log_path, encoding='utf-8') as log_file:
+            print(log_file.read())
+        self.stop_server()
+        sys.exit('The server did not start.')
+
+    def stop_server(self) -> None:
+        '''Stop the server and its child processes.'''
+
+        if self.server and self.server.poll() is None:
+            self.server.send_signal(signal.SIGINT)
+            try:
+                self.server.wait(5)
+            except TimeoutExpired:
+                self.server.kill()
+
+    def drive(self, modules: dict) -> None:
+        '''Rewrite random scripts at the given rate until the end of the test. A comment is
+        appended to each script, so its content changes as if it has been edited.'''
+
+        sources = {}
+        for module_name, module_path in modules.items():
+            with open(module_path, encoding='utf-8') as module_file:
+                sources[module_name] = module_file.read()
+
+        end_time = time() + self.duration
+        save_counter = 0
+
+        while time() < end_time:
+            if self.save_rate:
+                module_name = self.random.choice(self.modules_name)
+                save_counter += 1
+
+                with open(modules[module_name], 'w', encoding='utf-8') as module_file:
+                    module_file.write(sources[module_name])
+                    module_file.write(f'\n# loadtest save { save_counter }\n')
+                self.recorder.add_save(module_name)
+
+            sleep(min(1 / self.save_rate if self.save_rate else 1, max(0, end_time - time())))
+
+    def request(self, path: str, endpoint: str, headers: dict=None,
+            expected_status: list=None) -> tuple:
+        '''Send a GET request, record its duration, and return its status and body.'''
+
+        start_time = time()
+
+        try:
+            connection = http.client.HTTPConnection('localhost', self.port,
+                timeout=REQUEST_TIMEOUT)
+            connection.request('GET', path, headers=headers or {})
+            response = connection.getresponse()
+            status, body = response.status, response.read()
+            connection.close()
+        except (OSError, http.client.HTTPException):
+            status, body = 0, b''
+
+        self.recorder.add_request(endpoint, time() - start_time,
+            status not in (expected_status or [ 200 ]))
+        return status, body
+
+    def sample_rss(self) -> None:
+        '''Periodically record the resident memory of the server and its child processes.'''
+
+        start_time = time()
+
+        while not self.stopped.is_set() and self.server.poll() is None:
+            rss = get_tree_rss(self.server.pid)
+            if rss is not None:
+                self.recorder.add_rss(time() - start_time, rss)
+            self.stopped.wait(RSS_PERIOD)
+
+    def report(self) -> None:
+        '''Print the results of the load test, and save them as json if required.'''
+
+        recorder = self.recorder
+        lags, dropped = recorder.get_event_stats(self.clients_amount)
+        expected = len(recorder.saves) * self.clients_amount
+        results = { 'requests': {}, 'events': {}, 'rss': recorder.rss }
+
+        print()
+        print(f'{ "": <16}{ "count": >8}{ "errors": >8}'
+            + ''.join(f'{ f"p{ round(ratio * 100) } ms": >10}' for ratio in PERCENTILES))
+
+        for endpoint, durations in sorted(recorder.latencies.items()):
+            stats = get_percentiles(durations)
+            results['requests'][endpoint] = dict(stats, count=len(durations),
+                errors=recorder.errors[endpoint])
+            print_row(endpoint, len(durations), recorder.errors[endpoint], stats)
+
+        results['events'] = dict(get_percentiles(lags), saves=len(recorder.saves),
+            expected=expected, received=expected - dropped, dropped=dropped)
+        print_row('event lag', len(lags), dropped, get_percentiles(lags))
+
+        print()
+        print(f'Events: { len(recorder.saves) } saves, { self.clients_amount } clients, '
+            + f'{ expected } expected, { expected - dropped } received, { dropped } dropped.')
+
+        if recorder.rss:
+            rss_values = [ rss / 1024 / 1024 for _timestamp, rss in recorder.rss ]
+            print(f'Server RSS: { rss_values[0]:.1f} MB at start, { max(rss_values):.1f} MB max, '
+                + f'{ rss_values[-1]:.1f} MB at end.')
+
+            step = max(1, len(recorder.rss) // 10)
+            print('  ' + ', '.join(f'{ timestamp:.0f}s: { rss / 1024 / 1024:.1f} MB'
+                for timestamp, rss in recorder.rss[::step]))
+        else:
+            print('Server RSS: not available on this platform.')
+
+        if self.output:
+            with open(self.output, 'w', encoding='utf-8') as output_file:
+                json.dump(results, output_file, indent=2)
+            print(f'Results saved in { self.output }.')
+
+
+def get_percentiles(values: list) -> dict:
+    '''Return the percentiles of a list of durations in seconds, as milliseconds.'''
+
+    values = sorted(values)
+
+    return {
+        f'p{ round(ratio * 100) }': values[max(0, math.ceil(ratio * len(values)) - 1)] * 1000
+            if values else None
+        for ratio in PERCENTILES
+    }
+
+
+def print_row(label: str, count: int, errors: int, stats: dict) -> None:
+    '''Print a line of the results table.'''
+
+    values = [ '-' if value is None else f'{ value:.1f}' for value in stats.values() ]
+    print(f'{ label: <16}{ count: >8}{ errors: >8}' + ''.join(f'{ value: >10}' for value in values))
+
+
+def get_tree_rss(pid: int) -> int:
+    '''Return the resident memory of a process and its descendants in bytes, read from /proc,
+    or None if it is not available.'''
+
+    children = {}
+
+    try:
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{ entry }/stat', encoding='utf-8') as stat_file:
+                        # the process name can contain spaces, fields are read after it
+                        parent_pid = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+                    children.setdefault(parent_pid, []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass # the process has ended
+    except OSError:
+        return None
+
+    rss = 0
+    pids = [ pid ]
+    page_size = os.sysconf('SC_PAGE_SIZE')
+
+    while pids:
+        current_pid = pids.pop()
+        pids += children.get(current_pid, [])
+
+        try:
+            with open(f'/proc/{ current_pid }/statm', encoding='utf-8') as statm_file:
+                rss += int(statm_file.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+
+    return rss
+
+
+def parse_args() -> argparse.Namespace:
+    '''Parse the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Simulate concurrent viewers of cq-server.')
+
+    parser.add_argument('fixture', metavar='FIXTURE',
+        help='folder containing the CadQuery scripts to serve, copied before being modified')
+    parser.add_argument('-c', '--clients', type=int, default=10, metavar='N',
+        help='amount of simulated clients (default: 10)')
+    parser.add_argument('-d', '--duration', type=float, default=60, metavar='S',
+        help='duration of the test, in seconds (default: 60)')
+    parser.add_argument('-r', '--rate', type=float, default=0.5, metavar='N',
+        help='amount of script saves per second, 0 to disable them (default: 0.5)')
+    parser.add_argument('--poll-period', type=float, default=2, metavar='S',
+        help='mean delay between two requests of a client, in seconds (default: 2)')
+    parser.add_argument('--reload-ratio', type=float, default=0.1, metavar='R',
+        help='ratio of client requests loading the whole page (default: 0.1)')
+    parser.add_argument('--grace', type=float, default=10, metavar='S',
+        help='delay to wait for the last events after the end of the test (default: 10)')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+        help=f'server port (default: { DEFAULT_PORT })')
+    parser.add_argument('--server-args', default='', metavar='ARGS',
+        help='additional options given to cq-server run, ie. "--prebuild 2"')
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help='json file where the results are saved')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    LoadTest(parse_args()).run()